@@ -13,6 +13,12 @@ import time as t
 
 from matplotlib import pyplot as plt
 
+#Shared timeres reader (kept next to the GUI)
+import sys
+sys.path.append(str(Path(__file__).resolve().parents[2].joinpath("GUI")))
+import swab_timeres_lib as TR
+import timetag_formats as TF
+
 def eta_counter(recipe_file, timetag_file, **kwargs):
     #Load the recipe from seperate ETA file
     with open(recipe_file, 'r') as filehandle:
@@ -41,9 +47,29 @@ def eta_counter(recipe_file, timetag_file, **kwargs):
         print(f"{s} : {result[signals[s]]}")
 
 
+def native_counter(timetag_file, t_start=None, t_stop=None, timetag_format=None):
+    # Same counts as eta_counter(), but read straight from the file with numpy (no recipe to compile)
+    #   note: t_start, t_stop (ps, from first event) gives an optional time window (Swabian files only)
+    #   note: quTAG files (binary or compressed) are decoded with timetag_formats, format is detected if not given
+    t_0 = t.time()
+    if timetag_format is None:
+        timetag_format = TF.detect_format(timetag_file)
+    if timetag_format == TF.FORMAT_SI_16bytes:
+        counts = TR.count_signals(timetag_file, t_start=t_start, t_stop=t_stop)
+    else:
+        counts = TF.count_signals(timetag_file, timetag_format=timetag_format)
+
+    print("Signals : counts")
+    for s in counts:
+        print(f"{s} : {counts[s]}")
+    print(f"(counted in {round(t.time() - t_0, 3)} s)")
+    return counts
+
+
 recipe = 'signal_counter.eta'
 file = 'Data/Testing_ch1_negative_pulse_ch2_positive_pulse.timeres'  # not changed
-eta_counter(recipe, file)
+native_counter(file)
+#eta_counter(recipe, file)   # <-- slower, but useful to double check counts
 
 """
 test = 1
@@ -0,0 +1,94 @@
+#------IMPORTS-----
+#Packages used for analysis
+import csv
+import json
+import os
+import time as t
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+#Shared timeres reader (kept next to the GUI)
+import sys
+sys.path.append(str(Path(__file__).resolve().parents[2].joinpath("GUI")))
+import swab_timeres_lib as TR
+
+"""
+Counts signals and markers in every timeres file of a folder (ex: a whole day "Data/231030/"),
+spread over a process pool, and writes one summary table (csv and json) into the folder.
+
+Markers are counted on the GUI's marker channel (4) by default, and are not included in the mean count rate.
+
+USAGE (from terminal):
+    python batch_count_signals.py Data/231030                   # all cores
+    python batch_count_signals.py Data/231030 4                 # 4 processes
+    python batch_count_signals.py Data/231030 4 101,102         # 4 processes, files with markers remapped to 101 and 102
+"""
+
+
+def find_timeres_files(folder):
+    """ returns all timeres files in a folder, biggest first (so the slow ones start right away) """
+    files = [file for file in Path(folder).glob("*.timeres") if file.is_file()]
+    return sorted(files, key=lambda file: file.stat().st_size, reverse=True)
+
+
+def save_summary(summaries, folder, channels=TR.SIGNAL_CHANNELS):
+    """ saves one row per file to 'signal_summary.csv' and everything to 'signal_summary.json' """
+    # every channel seen in any file gets a column
+    all_channels = sorted(set(channels).union(*[s["counts"] for s in summaries]))
+    columns = ["file", "size_MB", "n_records", "n_markers", "duration_s", "mean_rate_Hz"]
+
+    csv_path = Path(folder).joinpath("signal_summary.csv")
+    with open(csv_path, "w", newline="") as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(columns + [f"c{ch}" for ch in all_channels])
+        for s in summaries:
+            writer.writerow([s[col] for col in columns] + [s["counts"].get(ch, 0) for ch in all_channels])
+
+    json_path = Path(folder).joinpath("signal_summary.json")
+    with open(json_path, "w") as jsonfile:
+        json.dump(summaries, jsonfile, indent=2)
+
+    print(f"Saved summary to:\n    {csv_path}\n    {json_path}")
+
+
+def batch_count(folder, n_workers=None, channels=TR.SIGNAL_CHANNELS, marker_channels=TR.GUI_MARKER_CHANNELS):
+    """ counts all timeres files in 'folder' in parallel, returns list of summaries (same order as file names) """
+    # note: each file is memory mapped and read in chunks in its own process, so this is mostly limited by disk speed
+    files = find_timeres_files(folder)
+    if not files:
+        print(f"No timeres files found in {folder}")
+        return []
+    if n_workers is None:
+        n_workers = min(os.cpu_count() or 1, len(files))
+
+    t_0 = t.time()
+    summaries = []
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        futures = {pool.submit(TR.summarize_file, file, channels, marker_channels): file for file in files}
+        for future in as_completed(futures):
+            try:
+                s = future.result()
+            except Exception as e:   # one broken file should not stop the whole folder
+                print(f"FAILED: {futures[future].name}  ({e})")
+                continue
+            s["file"] = Path(s["file"]).name
+            summaries.append(s)
+            print(f"{len(summaries)}/{len(files)}  {s['file']}  ({s['n_records']} records, {s['n_markers']} markers)")
+
+    summaries.sort(key=lambda s: s["file"])
+    total_MB = sum(s["size_MB"] for s in summaries)
+    elapsed = t.time() - t_0
+    print(f"--> Counted {len(summaries)} files ({total_MB:.1f} MB) with {n_workers} processes in {round(elapsed, 2)} s "
+          f"({total_MB / max(elapsed, 1e-9):.1f} MB/s)")
+
+    save_summary(summaries, folder, channels)
+    return summaries
+
+
+# NOTE: the guard is needed for the process pool on Windows (every worker imports this file)
+if __name__ == "__main__":
+    folder = sys.argv[1] if len(sys.argv) > 1 else 'Data/231030'
+    n_workers = int(sys.argv[2]) if len(sys.argv) > 2 and sys.argv[2] else None
+    marker_channels = tuple(int(ch) for ch in sys.argv[3].split(",")) if len(sys.argv) > 3 else TR.GUI_MARKER_CHANNELS
+    batch_count(folder, n_workers, marker_channels=marker_channels)
+    print("\ndone!")
@@ -27,12 +27,7 @@ import datetime
 
 # from WebSQControl import WebSQControl
 
-# Packages for ETA backend
-import json
-import etabackend.eta  # Available at: https://github.com/timetag/ETA, https://eta.readthedocs.io/en/latest/
-
 import os
-from pathlib import Path
 
 # --------
 import time
@@ -40,6 +35,8 @@ from labjack import ljm
 import socket
 import pickle
 
+import swab_timeres_lib as TR  # reading timeres files directly (signal counter etc.)
+
 # TODO (feb 26):
 #  Add something to indicate whether we are currently connected to Labjack
 #  Add visual indication that scan is active
@@ -540,13 +537,16 @@ class GUI:
 
             if not self.demo_mode.get():
                 self.logger_box.module_logger.info(f"new file name => {filename}")
+                t7.scanned_file = None  # note: new waveform from here, old file doesn't match it anymore
                 t7.main_galvo_scan()  # try to perform scan (including prepp and connections)
+                t7.scanned_file = self.anal_data_file.get()
 
                 self.data_file.set(filename)
 
             self.logger_box.module_logger.info(f"Done with scan!")
 
             # NOTE FIXME: MAKE SURE TO WAIT UNTIL DUMPING IS DONE BEFORE ANALYZING
+            #   --> Q.direct_analysis_multiframe(const, live=True) follows the file while it is written (TR.follow_rows)
             # self.logger_box.module_logger.info(f"Auto starting analysis of data")
             # print("Auto starting analysis of data")
             # all_figs = self.ETA_analysis()
@@ -612,30 +612,8 @@ class GUI:
     def counts_widget(self, tab):
         counts_frame = ttk.Frame(tab)  # always next to tabs (accessible in all tabs)
 
-        def eta_counter_swab(recipe_file, timetag_file, **kwargs):
-            # ________ LOAD RECIPE ETA ___________
-            with open(recipe_file, 'r') as filehandle:
-                recipe_obj = json.load(filehandle)
-            eta_engine = etabackend.eta.ETA()
-            eta_engine.load_recipe(recipe_obj)
-            # Set parameters in the recipe
-            for arg in kwargs:
-                print("Setting", str(kwargs[arg]), "= ", arg)
-                eta_engine.recipe.set_parameter(arg, str(kwargs[arg]))
-
-            eta_engine.load_recipe()
-            # -------------
-            file = Path(timetag_file)
-            cutfile = eta_engine.clips(filename=file, format=1)
-            result = eta_engine.run({"timetagger1": cutfile},
-                                    group='qutag')  # Runs the time tagging analysis and generates histograms
-
-            return result
-
         def press_count():
 
-            binsize = int(round((1 / (self.freq.get() * 1e-12)) / self.bins.get()))
-
             #folder = self.data_folder.get()
             #if len(folder) > 0:
             #    if folder[-1] not in ['/', '//', '\\']:
@@ -647,10 +625,15 @@ class GUI:
             if '.timeres' not in file_path:
                 file_path += '.timeres'
 
-            counts = eta_counter_swab('signal_counter.eta', file_path, binsize=binsize, bins=self.bins.get())
+            if not os.path.exists(file_path):
+                self.logger_box.module_logger.info(f"Error: datafile not found: {file_path}")
+                return
+
+            # counting directly from the file (memmap + bincount) instead of running "signal_counter.eta"
+            counts = TR.count_signals(file_path, channels=signals.keys())
 
             for sigi in signals.keys():
-                counts_labels[sigi].configure(text=f'      {counts[signals[sigi]]}')
+                counts_labels[sigi].configure(text=f'      {counts[sigi]}')
 
         signals = {0: 'c0', 1: 'c1', 2: 'c2', 3: 'c3', 4: 'c4',
                    5: 'c5', 6: 'c6', 7: 'c7',  # 8: 'c8',
@@ -898,6 +881,12 @@ class GUI:
             "gif_notes": gif_notes,
             "sweep_mode" : sweep_mode,
         }
+        # markers of each row: read from the recipe, otherwise channel 4 (T7.cmd_marker sends both markers 101 and 102 to the same input)
+        const["marker_channels"] = Q.get_recipe_marker_channels(eta_recipe) or TR.GUI_MARKER_CHANNELS
+        # if we just scanned this file: build the reconstruction from the exact waveform that was sent to the galvo
+        if len(t7.sine_values) > 0 and t7.scanned_file is not None and os.path.abspath(timetag_file) == os.path.abspath(t7.scanned_file):
+            const["sine_values"] = list(t7.sine_values)
+            const["b_scanRate"] = t7.b_scanRate
         #print("Using recipe:", eta_recipe)
         # --------- GET DATA AND HISTOGRAMS------------
 
@@ -921,6 +910,10 @@ class GUI:
 
         # testing prev version
         all_figs2 = Q.bap_eta_segmented_analysis_multiframe(const=const)  # note: all params we need are sent in with a dictionary. makes code cleaner
+        # all_figs2 = Q.bap_eta_batched_analysis_multiframe(const=const)  # same images, but processes all frames at once (faster for many frames)
+        # all_figs2 = Q.direct_analysis_multiframe(const=const)   # no ETA: photons are binned straight into pixels (no bins/binsize trade-off)
+        # const["channels"] = ["h1", "h2", "h3", "h4"]; all_figs2 = Q.bap_eta_multichannel_analysis_multiframe(const=const)   # all detectors in one pass
+        # all_figs2 = Q.tof_analysis_multiframe(const=const)      # ToF scans: intensity, gated image and lifetime map from per pixel arrival time histograms
 
         return all_figs2
 
@@ -1029,6 +1022,11 @@ class T7:
         self.x_offset = 0.59
         self.y_offset = -0.289
 
+        # Waveform of the last scan in this session (set in get_scan_parameters()/get_sine_values()), used by the analysis
+        self.sine_values = []
+        self.b_scanRate = None
+        self.scanned_file = None  # timeres file (path) the last scan wrote, the waveform above only belongs to this file
+
     # MAIN FUNCTION THAT PREPARES AND PERFORMS SCAN:
     def main_galvo_scan(self):
         self.abort_scan = False
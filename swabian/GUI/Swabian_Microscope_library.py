@@ -13,6 +13,9 @@ from matplotlib import pyplot as plt
 
 # Packages for analysis and computation
 import os
+import functools
+import hashlib
+import re
 from pathlib import Path
 import numpy as np
 
@@ -21,6 +24,10 @@ import json
 import etabackend.eta   # Available at: https://github.com/timetag/ETA, https://eta.readthedocs.io/en/latest/
 import time
 
+# Packages for reading timeres files directly (memmap, marker index, ...)
+import swab_timeres_lib as TR
+import swab_timeres_catalog as TC   # parsed scan parameters of all timeres files in a folder
+
 
 """
 FLIPPING AXIS:
@@ -38,17 +45,13 @@ axis=1 --> flips around y axis (left-right)
 # ----------- FILE HANDLING --------------
 def get_timres_name(folder, num, freq, clue):
     """ searches for timeres filename (that fits params) in a folder and returns the name """
-    for filename in os.listdir(folder):  # checks all files in given directory (where data should be)
-        print(filename)
-        print(str(num), str(freq), clue)
-        if clue in filename:
-            # NOTE: "clue" helps us differentiate between two with the same frequency (e.g. clue="figure_8")
-            if f"numFrames({num})" in filename:
-                if f"sineFreq({freq})" in filename:
-                    if ".timeres" in filename:
-                        #print("Using datafile:", filename)
-                        return folder + filename    # this is our found timetag_file!
-    print("No matching timeres file found! :(")
+    # NOTE: "clue" helps us differentiate between two with the same frequency (e.g. clue="figure_8")
+    # note: filenames are parsed once and kept in the folder's catalog (see swab_timeres_catalog.py), newest scan first
+    found = TC.find_files(folder, clue=clue, numFrames=num, sineFreq=freq)
+    if found:
+        #print("Using datafile:", found[0]["filename"])
+        return folder + found[0]["filename"]    # this is our found timetag_file!
+    print("No matching timeres file found! :(", str(num), str(freq), clue)
     return 'none'  # TODO FIXME
 
 def get_image_path(folder_name):
@@ -61,24 +64,26 @@ def get_image_path(folder_name):
 
 # ----------- MAIN ANALYSIS --------------
 def eta_segmented_analysis_multiframe(const):
-    """Extracts and processes one frame at a time. Due to this we have to do all image processing within the function"""
+    """Extracts and processes one frame at a time. Due to this we have to do all image processing within the function.
+    Returns one figure per frame, accumulated images (if any) are kept in const["accumulated_figs"]"""
 
-    # calculate sine times needed for speed adjustment (same values for all rows, so we only need to do it once)
-    t_from_even_y, y_even_spaced = get_t_of_y(res=const["dimY"], ampY=const["ampY"], frequency=const["freq_ps"])
+    if not validate_first(const):
+        return []
 
     # --- LOAD RECIPE ---
     eta_engine = load_eta(const["eta_recipe"], bins=const["bins"], binsize=const["binsize"])  # NOTE: removed for test
 
     # ------ETA PROCESSING-----
-    pos = 0           # internal ETA tracker (-> maybe tracks position in data list?)
     context = None    # tracks info about ETA logic, so we can extract and process data with breaks (i.e. in parts)
-    image_nr = 0      # tracks which frame is being processed
+    pos, image_nr = get_start_position(const)   # internal ETA tracker (-> maybe tracks position in data list?) and which frame is being processed. optional: jump straight to const["start_frame"] instead of frame 1
     all_matrix = []   # for 3D animation
     all_figs = []
+    acc = new_accumulator(const)   # optional: sum/mean of frames, see "ACCUMULATING FRAMES"
+    const["accumulated_figs"] = []   # note: kept apart, so all_figs[i] is still the figure of frame i
+    frame_buffer = np.zeros((const["dimX"], const["bins"]), dtype=np.uint32)   # rows are written straight into this (reused for every frame)
     # step 1) repeat extraction and creations of frames while there are more frames to be created
     while image_nr < const["nr_frames"]:
-        countrate_list = []
-        countrate_frame = []   # to save data the same way it comes in (alternative to countrate list with more flexibility)
+        n_rows = 0              # rows written into frame_buffer
         row_nr = 0
         image_nr += 1           # note: image number starts at 1 and not 0 (i.e. not regular indexing)
 
@@ -91,21 +96,17 @@ def eta_segmented_analysis_multiframe(const):
                 break
 
             # temp ceiling:
-            new_row = []
-            for thing in row:
-                new_row.append(min(thing, 4))
-            row = new_row
-
-            countrate_frame.append(list(row))
-            #print(len(row))
+            np.minimum(row, 4, out=frame_buffer[n_rows], casting='unsafe')
+            n_rows += 1
 
         print(row_nr)
         # At this point we have filled one full image/frame
         print(f"Frame {image_nr}/{const['nr_frames']} complete!")
+        countrate_frame = frame_buffer[:n_rows]   # view, no copy
 
         #  step 3) Flip every odd frame since we scan in different directions
-        if image_nr % 2 == 1:  # note: indexing starts att 1 so odd frames are at even values of 'image_nr'
-            countrate_frame = np.flip(np.array(countrate_frame))  # , axis=0)
+        if is_flipped_frame(image_nr, const):  # note: indexing starts att 1 so odd frames are at even values of 'image_nr'
+            countrate_frame = countrate_frame[::-1, ::-1]   # same as np.flip() on both axes, but a view
 
         #  -------  PROCESS DATA INTO IMAGE: --------
         # step 4) create non-speed-adjusted image, compressing bins if needed
@@ -113,8 +114,8 @@ def eta_segmented_analysis_multiframe(const):
         #draw_image_heatmap_3D(matrix=np.array(non_speed_matrix),  title=f"Speed adjusted - {image_nr}/{const['nr_frames']}\nScan frame rate: {const['scan_fps']} fps", fig_title=f"Speed adjusted - sine freq: {const['freq']} Hz",     save_fig=True, save_loc=const["save_location"]+"/Adjusted_Frames",    save_name=f"frame {image_nr}")
 
         # step 5) do speed adjustment on raw data
-        adjusted_matrix = speed_adjusted_matrix_timebased(countrate_frame, t_from_even_y, const)
-        all_matrix.append(np.array(adjusted_matrix))   # for 3D animation
+        adjusted_matrix = speed_adjust_with_plan(countrate_frame[np.newaxis], get_aligned_plan(const, countrate_frame, is_flipped_frame(image_nr, const)), const)[0]
+        all_matrix.append(adjusted_matrix)   # for 3D animation
 
         # step 6) create and save images of current frame:   # note: below two functions are needed to save figs and create gifs
 
@@ -122,6 +123,9 @@ def eta_segmented_analysis_multiframe(const):
         _ = draw_image_heatmap(matrix=np.array(non_speed_matrix), title=f"{image_nr}_Original image - {image_nr}/{const['nr_frames']}\nScan frame rate: {const['scan_fps']} fps", fig_title=f"{image_nr}_Non-speed adjusted - sine freq: {const['freq']} Hz", save_fig=True, save_loc=const["save_location"]+"/Original_Frames", save_name=f"frame {image_nr}")
         fig = draw_image_heatmap(matrix=np.array(adjusted_matrix),  title=f"{image_nr}_Speed adjusted - {image_nr}/{const['nr_frames']}\nScan frame rate: {const['scan_fps']} fps", fig_title=f"{image_nr}_Speed adjusted - sine freq: {const['freq']} Hz",     save_fig=True, save_loc=const["save_location"]+"/Adjusted_Frames",    save_name=f"frame {image_nr}")
         all_figs.append(fig)  # for GUI
+        fig_acc = draw_accumulated(acc, adjusted_matrix, image_nr, const)
+        if fig_acc is not None:
+            const["accumulated_figs"].append(fig_acc)
         #   -- Draw current frame - 3D plot:
         #draw_image_heatmap_3D(matrix=np.array(adjusted_matrix),  title=f"Speed adjusted - {image_nr}/{const['nr_frames']}\nScan frame rate: {const['scan_fps']} fps", fig_title=f"Speed adjusted - sine freq: {const['freq']} Hz",     save_fig=True, save_loc=const["save_location"]+"/Adjusted_Frames",    save_name=f"frame {image_nr}")
         #plt.show()
@@ -146,25 +150,24 @@ def eta_segmented_analysis_multiframe(const):
 def bap_eta_segmented_analysis_multiframe(const):
     """Extracts and processes one frame at a time. Due to this we have to do all image processing within the function"""
 
-    # calculate sine times needed for speed adjustment (same values for all rows, so we only need to do it once)
-    t_from_even_y, y_even_spaced = get_t_of_y(res=const["dimY"], ampY=const["ampY"], frequency=const["freq_ps"])
+    if not validate_first(const):
+        return []
 
     # --- LOAD RECIPE ---
     eta_engine = load_eta(const["eta_recipe"], bins=const["bins"], binsize=const["binsize"])  # NOTE: removed for test
 
     # ------ETA PROCESSING-----
-    pos = 0           # internal ETA tracker (-> maybe tracks position in data list?)
     context = None    # tracks info about ETA logic, so we can extract and process data with breaks (i.e. in parts)
-    image_nr = 0      # tracks which frame is being processed
+    pos, image_nr = get_start_position(const)   # internal ETA tracker (-> maybe tracks position in data list?) and which frame is being processed. optional: jump straight to const["start_frame"] instead of frame 1
     all_matrix = []   # for 3D animation
-    all_histo = []
     # step 1) repeat extraction and creations of frames while there are more frames to be created
     all_figs = []
+    acc = new_accumulator(const)   # optional: sum/mean of frames, see "ACCUMULATING FRAMES"
+    frame_buffer = np.zeros((const["dimX"], const["bins"]), dtype=np.uint32)   # rows are written straight into this (reused for every frame)
 
     while image_nr < const["nr_frames"]:  # note: maybe alternative condition
-        histo_frame = []
         run_flag = True         # useful if run flag condition is used instead of "break"
-        countrate_matrix = []   # to save data the same way it comes in (alternative to countrate list with more flexibility)
+        n_rows = 0              # rows written into frame_buffer
         row_nr = 0
         image_nr += 1           # note: image number starts at 1 and not 0 (i.e. not regular indexing)
 
@@ -179,51 +182,36 @@ def bap_eta_segmented_analysis_multiframe(const):
                 print("Row is None at:", row_nr)
                 continue
 
-            countrate_matrix.append(list(row))
-            histo_frame += list(row)
+            frame_buffer[n_rows] = row
+            n_rows += 1
             if row_nr == const["dimX"]:
                 # At this point we have filled one full image and want to move onto the next image
                 print(f"Frame {image_nr}/{const['nr_frames']} complete!")
                 # break out of inner while loop to process current frame to then start on next frame:
                 break
 
+        countrate_matrix = frame_buffer[:n_rows]   # view, no copy
+
         #  step 3) Flip every odd frame since we scan in different directions
-        if image_nr % 2 == 1:  # note: indexing starts att 1 so odd frames are at even values of 'image_nr'
-            countrate_matrix = np.flip(np.array(countrate_matrix))
+        if is_flipped_frame(image_nr, const):  # note: indexing starts att 1 so odd frames are at even values of 'image_nr'
+            countrate_matrix = countrate_matrix[::-1, ::-1]   # same as np.flip() on both axes, but a view
         #else:
         #    histo_frame.reverse()
         #    print("reversing frame", image_nr)
 
-        all_histo.append(histo_frame)
-
         #  -------  PROCESS DATA INTO IMAGE: --------
         # step 4) create non-speed-adjusted image, compressing bins if needed
         non_speed_matrix = build_image_matrix(countrate_matrix, const["bins"], const["dimY"])  # raw images, flipping comparison
 
         # step 5) do speed adjustment on raw data
-        adjusted_matrix = speed_adjusted_matrix_timebased(countrate_matrix, t_from_even_y, const)
+        adjusted_matrix = speed_adjust_with_plan(countrate_matrix[np.newaxis], get_aligned_plan(const, countrate_matrix, is_flipped_frame(image_nr, const)), const)[0]
 
         # step 6) create and save images of current frame:   # note: below two functions are needed to save figs and create gifs
-        fig_raw = draw_image_heatmap(matrix=np.array(non_speed_matrix), title=f"Raw/linear plt - {image_nr}/{const['nr_frames']}\nScan frame rate: {const['scan_fps']} fps",
-                                     fig_title=f"Non-speed adjusted - sine freq: {const['freq']} Hz", save_fig=True,
-                                     save_loc=const["save_location"]+"/Original_Frames", save_name=f"frame {image_nr}", figsize=(4,4))
-        fig_spe = draw_image_heatmap(matrix=np.array(adjusted_matrix),  title=f"Sine adjusted  - {image_nr}/{const['nr_frames']}\nScan frame rate: {const['scan_fps']} fps",
-                                     fig_title=f"Speed adjusted - sine freq: {const['freq']} Hz",     save_fig=True,
-                                     save_loc=const["save_location"]+"/Adjusted_Frames",    save_name=f"frame {image_nr}", figsize=(4,4))
-
+        all_figs.append(draw_frame(adjusted_matrix, non_speed_matrix, image_nr, const, acc))  # for GUI
         #plt.show()
-        if const["sweep_mode"] == "linear":
-            all_figs.append([fig_raw, fig_spe])  # for GUI
-        else:
-            all_figs.append([fig_spe, fig_raw])  # for GUI
 
     print("Complete with ETA.")
 
-    #for h in range(len(all_histo)):
-    #    plt.figure(f"Histo for frame {h+1}")
-    #    plt.plot(all_histo[h])
-    #    plt.title(f"Histo for frame {h+1}")
-
     plt.figure(f"Histos for frame {0}")
     for h in range(len(countrate_matrix)):
         plt.plot(countrate_matrix[h])
@@ -240,8 +228,301 @@ def bap_eta_segmented_analysis_multiframe(const):
     return all_figs
 
 
+#BATCHED
+def bap_eta_batched_analysis_multiframe(const):
+    """Same as bap_eta_segmented_analysis_multiframe(), but collects several frames into one (frames, rows, bins) array and
+    processes them all at once. Number of frames per batch: const["batch_frames"] (default: all frames)"""
+    # NOTE: memory for one batch = batch_frames * dimX * bins * 4 bytes  (ex: 50 frames, 100 rows, 20000 bins --> 400 MB)
+
+    if not validate_first(const):
+        return []
+
+    # --- LOAD RECIPE ---
+    eta_engine = load_eta(const["eta_recipe"], bins=const["bins"], binsize=const["binsize"])
+
+    # ------ETA PROCESSING-----
+    context = None
+    pos, image_nr = get_start_position(const)   # optional: jump straight to const["start_frame"] instead of frame 1
+    batch_frames = min(const.get("batch_frames", const["nr_frames"]), const["nr_frames"] - image_nr)
+    cube = np.zeros((max(batch_frames, 1), const["dimX"], const["bins"]), dtype=np.uint32)   # preallocated once, reused for each batch
+    all_figs = []
+    acc = new_accumulator(const)   # optional: sum/mean of frames, see "ACCUMULATING FRAMES"
+    run_flag = True
+
+    while image_nr < const["nr_frames"] and run_flag:
+        # step 1) fill the cube with the next batch of frames, straight from ETA
+        n_frames = min(len(cube), const["nr_frames"] - image_nr)
+        cube[:] = 0
+        first_image_nr = image_nr + 1   # note: image number starts at 1 and not 0 (i.e. not regular indexing)
+        for frame_i in range(n_frames):
+            row_nr = 0
+            while row_nr < const["dimX"] and run_flag:
+                row, pos, context, run_flag = bap_get_row_from_eta(eta_engine=eta_engine, pos=pos, context=context, ch_sel=const["ch_sel"], timetag_file=const["timetag_file"], run_flag=run_flag)
+                if row is None:
+                    print("Row is None at:", row_nr)
+                    continue
+                cube[frame_i, row_nr, :] = row
+                row_nr += 1
+            if row_nr < const["dimX"]:
+                print(f"CAUTION: premature break, frame {first_image_nr + frame_i} only has {row_nr}/{const['dimX']} rows")
+                n_frames = frame_i + 1
+                break
+        image_nr += n_frames
+        frames = cube[:n_frames]
+
+        # step 2) Flip every odd frame since we scan in different directions (same as np.flip() on the whole frame)
+        odd = slice(0 if is_flipped_frame(first_image_nr, const) else 1, None, 2)
+        even = slice(1 if is_flipped_frame(first_image_nr, const) else 0, None, 2)
+        frames[odd] = frames[odd, ::-1, ::-1]
+
+        # step 3) non-speed-adjusted and speed adjusted images, for all frames in the batch at once
+        non_speed_stack = build_image_matrix(frames, const["bins"], const["dimY"])
+        adjusted_stack = np.zeros((n_frames, const["dimX"], const["dimY"]), dtype=np.float32)
+        for group, flipped in [(odd, True), (even, False)]:
+            if len(frames[group]) > 0:
+                adjusted_stack[group] = speed_adjust_with_plan(frames[group], get_aligned_plan(const, frames[group][0], flipped), const)
+        print(f"Frames {first_image_nr}-{image_nr}/{const['nr_frames']} complete!")
+
+        # step 4) create and save images of each frame
+        for frame_i in range(n_frames):
+            all_figs.append(draw_frame(adjusted_stack[frame_i], non_speed_stack[frame_i], first_image_nr + frame_i, const, acc))  # for GUI
+
+    print("Complete with ETA.")
+    return all_figs
+
+
+#DIRECT
+def direct_analysis_multiframe(const, live=False):
+    """Same images as bap_eta_segmented_analysis_multiframe(), but each photon is binned straight into its pixel (no ETA, no histograms).
+    See "DIRECT BINNING (NO ETA HISTOGRAMS)" below.
+    live=True: start while the scan is still writing the file, each frame is drawn as soon as its rows are in (see "LIVE DIRECT BINNING")"""
+
+    if not live and not validate_first(const):
+        return []
+
+    first_frame = const.get("start_frame", 1) - 1   # note: frame numbers start at 1 in const, like 'image_nr'
+    n_frames = const["nr_frames"] - first_frame
+
+    if live:
+        frames = iter_live_frames(const, first_frame, n_frames)   # note: waits for the timetagger, one frame at a time
+    else:
+        # sweep lag is measured on a time histogram of the first frame, just like with ETA rows
+        if const.get("align_sweeps", False) and const.get("sweep_lag_ps") is None:
+            const["sweep_lag_ps"] = estimate_sweep_lag(histogram_frame_direct(const, first_frame), const["binsize"])
+            print(f"Sweep lag: {const['sweep_lag_ps']:.0f} ps ({const['sweep_lag_ps'] / const['binsize']:.2f} bins)")
+
+        t_start = time.time()
+        adjusted_stack, non_speed_stack = bin_photons_into_frames(const, first_frame, n_frames)
+        print(f"Binned {n_frames} frames in {time.time() - t_start:.2f} s")
+        frames = zip(range(n_frames), adjusted_stack, non_speed_stack)
+
+    all_figs = []
+    acc = new_accumulator(const)   # optional: sum/mean of frames, see "ACCUMULATING FRAMES"
+    for frame_i, adjusted_matrix, non_speed_matrix in frames:
+        all_figs.append(draw_frame(adjusted_matrix, non_speed_matrix, first_frame + frame_i + 1, const, acc))  # for GUI
+
+    print("Complete without ETA.")
+    return all_figs
+
+
+#MULTICHANNEL
+def bap_eta_multichannel_analysis_multiframe(const):
+    """Same as bap_eta_segmented_analysis_multiframe(), but for all channels in const["channels"] (ex: ["h1", "h2", "h3", "h4"]) in the
+    same pass over the data. Each frame is a (channels, dimX, bins) stack, images of each channel are saved in save_location/<channel>"""
+    # NOTE: the recipe must fill a histogram for every channel we ask for
+
+    if not validate_first(const):
+        return []
+
+    channels = get_channel_names(const)
+    print("using channels", channels)
+
+    # --- LOAD RECIPE ---
+    eta_engine = load_eta(const["eta_recipe"], bins=const["bins"], binsize=const["binsize"])
+
+    # ------ETA PROCESSING-----
+    context = None
+    pos, image_nr = get_start_position(const)   # optional: jump straight to const["start_frame"] instead of frame 1
+    all_figs = []
+    accs = {name: new_accumulator(const) for name in channels}   # optional: sum/mean of frames, one for each channel
+    frame_buffer = np.zeros((len(channels), const["dimX"], const["bins"]), dtype=np.uint32)   # reused for every frame
+    run_flag = True
+
+    while image_nr < const["nr_frames"] and run_flag:
+        n_rows = 0
+        image_nr += 1           # note: image number starts at 1 and not 0 (i.e. not regular indexing)
+        # step 1) rows of all channels at once
+        while n_rows < const["dimX"] and run_flag:
+            rows, pos, context, run_flag = bap_get_row_from_eta(eta_engine=eta_engine, pos=pos, context=context, ch_sel=channels, timetag_file=const["timetag_file"], run_flag=run_flag)
+            if rows is None:
+                print("Row is None at:", n_rows + 1)
+                continue
+            frame_buffer[:, n_rows] = rows
+            n_rows += 1
+        if n_rows < const["dimX"]:
+            print(f"CAUTION: premature break, frame {image_nr} only has {n_rows}/{const['dimX']} rows")
+            break
+        print(f"Frame {image_nr}/{const['nr_frames']} complete!")
+
+        # step 2) Flip every odd frame since we scan in different directions
+        channel_stack = frame_buffer
+        flipped = is_flipped_frame(image_nr, const)
+        if flipped:
+            channel_stack = channel_stack[:, ::-1, ::-1]   # view, all channels at once
+
+        # step 3) all channels share the resampling plan (and sweep lag, measured on the first channel)
+        non_speed_stack = build_image_matrix(channel_stack, const["bins"], const["dimY"])   # (channels, dimX, dimY)
+        adjusted_stack = speed_adjust_with_plan(channel_stack, get_aligned_plan(const, channel_stack[0], flipped), const)
+
+        # step 4) create and save images of each channel
+        all_figs.append(draw_channel_frames(adjusted_stack, non_speed_stack, image_nr, const, channels, accs))
+
+    print("Complete with ETA.")
+    return all_figs
+
+def direct_multichannel_analysis_multiframe(const):
+    """Same as direct_analysis_multiframe(), but for all channels in const["channels"] in one pass over the file (no ETA)."""
+
+    if not validate_first(const):
+        return []
+
+    channels = get_channel_names(const)
+    first_frame = const.get("start_frame", 1) - 1   # note: frame numbers start at 1 in const, like 'image_nr'
+    n_frames = const["nr_frames"] - first_frame
+
+    # sweep lag is measured on the first channel
+    if const.get("align_sweeps", False) and const.get("sweep_lag_ps") is None:
+        first_channel = dict(const, photon_channel=get_channel_number(channels[0]))
+        const["sweep_lag_ps"] = estimate_sweep_lag(histogram_frame_direct(first_channel, first_frame), const["binsize"])
+        print(f"Sweep lag: {const['sweep_lag_ps']:.0f} ps ({const['sweep_lag_ps'] / const['binsize']:.2f} bins)")
+
+    t_start = time.time()
+    adjusted_stack, non_speed_stack = bin_photons_into_channel_frames(const, first_frame, n_frames)   # (frames, channels, dimX, dimY)
+    print(f"Binned {n_frames} frames of channels {channels} in {time.time() - t_start:.2f} s")
+
+    all_figs = []
+    accs = {name: new_accumulator(const) for name in channels}
+    for frame_i in range(n_frames):
+        all_figs.append(draw_channel_frames(adjusted_stack[frame_i], non_speed_stack[frame_i], first_frame + frame_i + 1, const, channels, accs))
+
+    print("Complete without ETA.")
+    return all_figs
+
+
+#TOF
+def tof_analysis_multiframe(const):
+    """Builds the per pixel time of flight cube of all frames (no ETA) and draws the intensity image, a time gated image
+    (const["tof_gate_ps"] = (start, stop)) and the lifetime map. The cube is kept in const["tof_cube"] for more gates later."""
+
+    if not validate_first(const):
+        return []
+
+    first_frame = const.get("start_frame", 1) - 1   # note: frame numbers start at 1 in const, like 'image_nr'
+    n_frames = const["nr_frames"] - first_frame
+
+    t_start = time.time()
+    cube = build_tof_cube(const, first_frame, n_frames)
+    const["tof_cube"] = cube
+    print(f"ToF cube {cube['shape']} from {n_frames} frames in {time.time() - t_start:.2f} s: "
+          f"{len(cube['index'])} non-empty cells ({100 * len(cube['index']) / np.prod(cube['shape']):.2f} %), {int(cube['counts'].sum())} photons")
+    if const.get("tof_cube_file"):
+        save_tof_cube(cube, const["tof_cube_file"])
+
+    save_loc = const["save_location"] + "/ToF"
+    frames_text = f"frames {first_frame + 1}-{const['nr_frames']}"
+    figs = [draw_image_heatmap(matrix=get_gated_image(cube), title=f"Intensity - {frames_text}", fig_title="ToF intensity",
+                               save_fig=True, save_loc=save_loc, save_name="intensity", figsize=(4,4)),
+            draw_image_heatmap(matrix=get_lifetime_map(cube, min_counts=const.get("lifetime_min_counts", 20)) / 1000, cmap='viridis',
+                               title=f"Lifetime (ns) - {frames_text}", fig_title="ToF lifetime",
+                               save_fig=True, save_loc=save_loc, save_name="lifetime", figsize=(4,4))]
+    if const.get("tof_gate_ps") is not None:
+        gate_start, gate_stop = const["tof_gate_ps"]
+        figs.append(draw_image_heatmap(matrix=get_gated_image(cube, gate_start, gate_stop), title=f"Gated {gate_start}-{gate_stop} ps - {frames_text}",
+                                       fig_title="ToF gated", save_fig=True, save_loc=save_loc, save_name=f"gated {gate_start}-{gate_stop}", figsize=(4,4)))
+
+    print("Complete without ETA.")
+    return [figs]
+
+
+def get_start_position(const):
+    """ returns (ETA event position, frames already done) to start analysis at const["start_frame"] (default: first frame).
+    Frames are found with the markers on const["marker_channels"] (default TR.MARKER_CHANNELS, GUI files: (4,)) """
+    start_frame = const.get("start_frame", 1)   # note: frame numbers start at 1 here, like 'image_nr'
+    if start_frame <= 1:
+        return 0, 0
+    # look up first record of the frame in the marker index sidecar (built once, with one pass over the file)
+    markers = TR.load_marker_index(const["timetag_file"], marker_channels=const.get("marker_channels", TR.MARKER_CHANNELS))
+    pos, _ = TR.get_frame_range(markers, frame=start_frame - 1, dimX=const["dimX"])
+    print(f"Starting at frame {start_frame}, record {pos}")
+    return pos, start_frame - 1
+
+def is_flipped_frame(image_nr, const):
+    """ True for frames scanned in the other direction (image_nr starts at 1, works on arrays too).
+    For files cut out of a scan (TR.extract_frames), const["first_frame_nr"] = original number (from 0) of the first frame keeps the parity """
+    return (image_nr + const.get("first_frame_nr", 0)) % 2 == 1
+
+def validate_first(const):
+    """ optional (const["validate"] = True): quick check of the file before the analysis, so a broken file doesn't fail after minutes
+    of processing. Returns False if the file should not be analyzed """
+    return not const.get("validate", False) or check_timeres_file(const)
+
+def check_timeres_file(const):
+    """ validates markers (on const["marker_channels"], default TR.MARKER_CHANNELS), time order and gaps of const["timetag_file"]
+    in one pass. Returns True if the file looks ok """
+    report = TR.validate_timeres(const["timetag_file"], step_dim=const["dimX"], nr_frames=const["nr_frames"], sine_freq=const["freq"],
+                                 marker_channels=const.get("marker_channels", TR.MARKER_CHANNELS))
+    TR.print_report(report)
+    return report["ok"]
+
+def draw_frame(adjusted_matrix, non_speed_matrix, image_nr, const, acc=None, label=""):
+    """ draws and saves the speed adjusted, non-speed adjusted (and accumulated) images of one frame.
+    Returns the figures for the GUI: [speed adjusted, raw] ([raw, speed adjusted] for linear sweeps), then the accumulated one if any """
+    fig_raw = draw_image_heatmap(matrix=non_speed_matrix, title=f"{label}Raw/linear plt - {image_nr}/{const['nr_frames']}\nScan frame rate: {const['scan_fps']} fps",
+                                 fig_title=f"{label}Non-speed adjusted - sine freq: {const['freq']} Hz", save_fig=True,
+                                 save_loc=const["save_location"]+"/Original_Frames", save_name=f"frame {image_nr}", figsize=(4,4))
+    fig_spe = draw_image_heatmap(matrix=adjusted_matrix, title=f"{label}Sine adjusted  - {image_nr}/{const['nr_frames']}\nScan frame rate: {const['scan_fps']} fps",
+                                 fig_title=f"{label}Speed adjusted - sine freq: {const['freq']} Hz",     save_fig=True,
+                                 save_loc=const["save_location"]+"/Adjusted_Frames",    save_name=f"frame {image_nr}", figsize=(4,4))
+    fig_acc = draw_accumulated(acc, adjusted_matrix, image_nr, const)
+    figs = [fig_raw, fig_spe] if const["sweep_mode"] == "linear" else [fig_spe, fig_raw]
+    if fig_acc is not None:
+        figs.append(fig_acc)
+    return figs
+
+def draw_channel_frames(adjusted_stack, non_speed_stack, image_nr, const, channels, accs):
+    """ draws and saves the images of each channel of one frame in save_location/<channel>/... Returns the figures of all channels """
+    figs = []
+    for ch_i, name in enumerate(channels):
+        ch_const = dict(const, save_location=f"{const['save_location']}/{name}")
+        figs += draw_frame(adjusted_stack[ch_i], non_speed_stack[ch_i], image_nr, ch_const, accs[name], label=f"{name} ")
+    return figs
+
+
 # ----------- ETA DATA --------------
+"""
+Compiling a recipe takes a few seconds, so compiled engines are kept for the whole session (LRU cache, ETA_CACHE_SIZE engines).
+An engine is reused when the recipe file (path + modified time) and the parameters (bins, binsize, ...) are the same,
+so editing the recipe file recompiles it automatically. Use clear_eta_cache() to force a fresh engine.
+NOTE: the same engine is shared between analyses, so don't run two analyses at the same time (in threads)
+"""
+ETA_CACHE_SIZE = 4      # nr of compiled engines kept in memory
+
 def load_eta(recipe, **kwargs):
+    """ returns the compiled ETA engine for a recipe with parameters (kwargs), from the cache if we compiled it before """
+    recipe_path = Path(recipe).resolve()
+    params = tuple(sorted((arg, str(value)) for arg, value in kwargs.items()))   # note: the recipe gets all parameters as text anyway
+    return load_eta_engine(str(recipe_path), os.stat(recipe_path).st_mtime_ns, params)
+
+@functools.lru_cache(maxsize=ETA_CACHE_SIZE)
+def load_eta_engine(recipe, mtime_ns, params):
+    """ reads and compiles a recipe. Note: mtime_ns is only part of the cache key, so a changed recipe file gets a new engine """
+    return compile_eta(recipe, **dict(params))
+
+def clear_eta_cache():
+    """ drops all compiled engines, the next load_eta() compiles the recipe again """
+    load_eta_engine.cache_clear()
+
+def compile_eta(recipe, **kwargs):
     print('Loading ETA')
     with open(recipe, 'r') as filehandle:
         recipe_obj = json.load(filehandle)
@@ -259,6 +540,27 @@ def load_eta(recipe, **kwargs):
     print("recipe loaded")
     return eta_engine
 
+def get_recipe_marker_channels(recipe):
+    """ returns the marker channels of a recipe (ex: (4,) for "..._marker4_28.eta"), or None if we can't tell """
+    # NOTE: channels in the state machine that are not histogrammed (HISTOGRAM(hN, ...) records channel N) are the markers
+    try:
+        with open(recipe, 'r') as filehandle:
+            recipe_obj = json.load(filehandle)
+    except (OSError, ValueError):
+        return None
+    for value in recipe_obj.values():
+        if not isinstance(value, str) or '"edges"' not in value:
+            continue
+        try:
+            graph = json.loads(value)
+        except ValueError:
+            continue
+        histogram_channels = {int(ch) for ch in re.findall(r"HISTOGRAM\(\s*h(\d+)", graph.get("usercode", ""))}
+        edge_channels = {int(ch) for edge in graph.get("edges", []) for ch in str(edge.get("text", "")).split(",") if ch.strip().isdigit()}
+        if histogram_channels and edge_channels - histogram_channels:
+            return tuple(sorted(edge_channels - histogram_channels))
+    return None
+
 """
     # Create an instance of the TimeTagger
     tagger = createTimeTagger()
@@ -340,10 +642,82 @@ def bap_get_row_from_eta(eta_engine, pos, context, ch_sel, timetag_file, run_fla
         return None, None, None, run_flag
 
     pos = result['timetagger1'].get_pos()
-    row = result[ch_sel]  # [result['X']]
+    if isinstance(ch_sel, (list, tuple)):
+        row = np.stack([result[ch] for ch in ch_sel])   # several channels --> (channels, bins), same pass over the data
+    else:
+        row = result[ch_sel]  # [result['X']]
     return row, pos, context, run_flag
 
 
+# ----------- ACCUMULATING FRAMES --------------
+"""
+For low light samples we want to see many frames added together while the analysis runs, not only each frame on its own.
+const["accumulate"] = "sum"   --> sum of all frames so far
+                      "mean"  --> mean of the last const["accumulate_frames"] frames (ring buffer, default 10)
+                      "ewma"  --> exponentially weighted mean, new frame weight const["ewma_alpha"] (default 0.2)
+Each update only touches the pixels of one frame. Images are saved in "/Accumulated_Frames", next to the normal frames.
+"""
+ACCUMULATE_MODES = ("sum", "mean", "ewma")
+
+def new_accumulator(const):
+    """ returns the accumulation state for const["accumulate"], or None if we don't accumulate """
+    mode = const.get("accumulate")
+    if mode is None:
+        return None
+    if mode not in ACCUMULATE_MODES:
+        raise ValueError(f"Unknown accumulate mode '{mode}', use one of {ACCUMULATE_MODES}")
+    shape = (const["dimX"], const["dimY"])
+    window = int(const.get("accumulate_frames", 10)) if mode == "mean" else 0
+    return {
+        "mode": mode,
+        "window": window,
+        "alpha": float(const.get("ewma_alpha", 0.2)),
+        "n_frames": 0,
+        "total": np.zeros(shape, dtype=np.float64),            # sum (sum/mean) or weighted mean (ewma)
+        "ring": np.zeros((window,) + shape, dtype=np.float64),  # last 'window' frames, only for "mean"
+        "image": np.zeros(shape, dtype=np.float32),             # accumulated image, updated in place
+    }
+
+def accumulate_frame(acc, frame):
+    """ adds one (speed adjusted) frame and returns the accumulated image. Note: the returned array is reused for the next frame """
+    frame = np.asarray(frame, dtype=np.float64)
+    total = acc["total"]
+    if acc["mode"] == "sum":
+        total += frame
+        acc["image"][:] = total
+    elif acc["mode"] == "mean":
+        slot = acc["n_frames"] % acc["window"]
+        total -= acc["ring"][slot]     # oldest frame leaves the window (zeros until the ring is full)
+        acc["ring"][slot] = frame
+        total += frame
+        np.divide(total, min(acc["n_frames"] + 1, acc["window"]), out=acc["image"], casting='unsafe')
+    else:
+        if acc["n_frames"] == 0:
+            total[:] = frame
+        else:
+            total += acc["alpha"] * (frame - total)
+        acc["image"][:] = total
+    acc["n_frames"] += 1
+    return acc["image"]
+
+def get_accumulation_label(acc):
+    """ short text for the title of the accumulated image """
+    if acc["mode"] == "sum":
+        return f"Sum of {acc['n_frames']} frames"
+    if acc["mode"] == "mean":
+        return f"Mean of last {min(acc['n_frames'], acc['window'])} frames"
+    return f"EWMA (alpha={acc['alpha']}) of {acc['n_frames']} frames"
+
+def draw_accumulated(acc, adjusted_matrix, image_nr, const):
+    """ adds a speed adjusted frame to the accumulation and saves the accumulated image. Returns the figure (None if we don't accumulate) """
+    if acc is None:
+        return None
+    image = accumulate_frame(acc, adjusted_matrix)
+    return draw_image_heatmap(matrix=image, title=f"{get_accumulation_label(acc)} - {image_nr}/{const['nr_frames']}\nScan frame rate: {const['scan_fps']} fps",
+                              fig_title=f"Accumulated ({acc['mode']}) - sine freq: {const['freq']} Hz", save_fig=True,
+                              save_loc=const["save_location"]+"/Accumulated_Frames", save_name=f"frame {image_nr}", figsize=(4,4))
+
+
 # ----------- DRAWING AND SAVING IMAGES --------------
 def draw_image_heatmap(matrix, title="", fig_title="", cmap='hot', save_fig=False, save_loc="misc", save_name="misc", figsize=(5,5)):
     """Generic method for any imshow() we want to do"""
@@ -445,7 +819,7 @@ def add_to_gif(location, folder, const, gif_frame_rate, note="", overlay=False):
         # Additional text added to gif such as playback frame rate and timestamp of used timeres
         if overlay:
             draw_frame = ImageDraw.Draw(new_frame)
-            text = f"Playback: {gif_frame_rate} fps  {note}\nScan timestamp: {const['timetag_file'][-27:-25]}/{const['timetag_file'][-29:-27]}/20{const['timetag_file'][-31:-29]} ({const['timetag_file'][-18:-9]})"
+            text = f"Playback: {gif_frame_rate} fps  {note}\nScan timestamp: {TC.get_scan_timestamp(const['timetag_file'])}"
             draw_frame.text((10, 450), text, fill=grey)  # , font=font)   # TODO: maybe increase font size
         frames.append(new_frame)
 
@@ -455,30 +829,137 @@ def add_to_gif(location, folder, const, gif_frame_rate, note="", overlay=False):
 
 # ----------- DATA PROCESSING: NON-SPEED ADJUSTED --------------
 def build_image_matrix(countrate_matrix, bins, dimY):
-    img = []
+    """ returns the non-speed adjusted image (dimX, dimY) of a whole frame (dimX, bins), both sweeps added together """
+    # note: also works for a stack of frames (frames, dimX, bins) --> (frames, dimX, dimY)
+    frame = np.asarray(countrate_matrix)
+    half = int(bins / 2)
+    combined_flipped = frame[..., :half] + np.flip(frame[..., half:2 * half], axis=-1)   # second sweep goes the other way
     if bins > dimY:   # <- compressing/combining bins to get square pixels
-        for row in countrate_matrix:
-            combined_flipped = list(np.array(row[:int(bins / 2)]) + np.array(np.flip(row[int(bins / 2):])))
-            img.append(compress_bins_into_pixels(bins=bins, pixY=dimY, row=combined_flipped))
-    else:
-        for row in countrate_matrix:
-            combined_flipped = list(np.array(row[:int(bins / 2)]) + np.array(np.flip(row[int(bins / 2):])))
-            img.append(combined_flipped)
-    return img
+        return compress_bins_into_pixels(bins=bins, pixY=dimY, row=combined_flipped).astype(np.float32)
+    return combined_flipped.astype(np.float32)
 
 def compress_bins_into_pixels(bins, pixY, row):
-    """ Compresses bins into pixel values. argument "row" = combined row (from multiple sweeps) or a row for a single sweep"""
-    compressed_list = []
-    n_sweeps = 2        # here we need to account input argument "row" being one sweep, while bins includes all sweeps
-    extra = int(round(bins / (n_sweeps * pixY)))   # if (bins = 40000)  --> (after we've combined two sweeps -> bins_combined = bins/2 = 20000) and  (dimY = 100)  --> bins_combined/dimY = 200  --> we need to compress every 200 values into one
-    for i in range(pixY):
-        pixel_sum = sum(row[i * extra:(i + 1) * extra])   # sum values in bins to make up one equally sized pixel
-        compressed_list.append(pixel_sum)
-
-    return compressed_list
+    """ Compresses bins into pixel values. argument "row" = combined row(s) (from multiple sweeps) or a row for a single sweep"""
+    # note: works on one row or on a whole frame at once (bins along the last axis)
+    row = np.asarray(row)
+    n_bins = row.shape[-1]     # if (bins = 40000)  --> (after we've combined two sweeps -> bins_combined = bins/2 = 20000) and  (dimY = 100)  --> bins_combined/dimY = 200  --> we need to compress every 200 values into one
+    if n_bins % pixY == 0:
+        # each pixel gets the same whole nr of bins --> just reshape and sum
+        return row.reshape(row.shape[:-1] + (pixY, n_bins // pixY)).sum(axis=-1)
+
+    # NOTE: bins don't split evenly into pixels --> a bin on the edge between two pixels is shared by both, weighted by overlap.
+    #   Done with the cumulative sum: counts up to a (fractional) bin position x = summed[floor(x)] + fraction * row[floor(x)]
+    summed = np.zeros(row.shape[:-1] + (n_bins + 1,), dtype=np.float64)
+    np.cumsum(row, axis=-1, out=summed[..., 1:])
+    padded = np.concatenate([row, np.zeros(row.shape[:-1] + (1,), dtype=row.dtype)], axis=-1)
+
+    pixel_edges = np.arange(pixY + 1) * (n_bins / pixY)
+    whole = np.minimum(np.floor(pixel_edges).astype(np.int64), n_bins)
+    fraction = pixel_edges - whole
+    counts_to_edge = summed[..., whole] + fraction * padded[..., whole]
+    return np.diff(counts_to_edge, axis=-1)
 
 # ----------- DATA PROCESSING: SPEED ADJUSTED --------------
-def speed_adjusted_matrix_timebased(countrate_matrix, t_from_even_y, const):
+def get_pixel_bin_edges(t_from_even_y, binsize):
+    """ returns the histogram bin where each pixel of one sweep starts (last value = bins used per sweep) """
+    # NOTE: same stepping rule as the original loop (see speed_adjusted_matrix_timebased_loop), so the pixels get exactly the same bins:
+    #   a pixel takes bins while (time at pixel edge - time of bins so far) >= binsize
+    edges = np.zeros(len(t_from_even_y) + 1, dtype=np.int64)
+    n_bins = 0
+    for y_pix, max_pix_time in enumerate(t_from_even_y):
+        n_bins = max(n_bins, int(max_pix_time // binsize) - 1)    # jump close to the edge, then step like the loop did
+        while (max_pix_time - n_bins * binsize) >= binsize:
+            n_bins += 1
+        edges[y_pix + 1] = n_bins
+    return edges
+
+def speed_adjusted_matrix_timebased(countrate_matrix, t_from_even_y, const, pixel_edges=None):
+    """ sums histogram bins into pixels with equal size (in space), both sweeps of a step are combined into one image row """
+    # note: the bin --> pixel map is the same for every row, so we sum all rows of the frame at once with np.add.reduceat
+    if pixel_edges is None:
+        pixel_edges = get_pixel_bin_edges(t_from_even_y, const["binsize"])
+    sweep_repeats = 2   # how many times we sweep the same step value, --> obs: this depends on the scan code. bidirectional raster -> 2 repeats
+
+    frame = np.asarray(countrate_matrix).reshape(1, -1)
+    return list(speed_adjust_frames(frame, pixel_edges, const["dimX"], sweep_repeats)[0])
+
+def speed_adjust_frames(frames, pixel_edges, dimX, sweep_repeats=2):
+    """ speed adjustment for a stack of frames at once: (frames, ...) counts --> (frames, dimX, dimY) image """
+    # NOTE: the bins are taken one after the other from the whole frame (like the loop did), not row by row
+    countrate = np.asarray(frames).reshape(len(frames), -1)
+    bins_per_sweep = int(pixel_edges[-1])
+    n_needed = dimX * sweep_repeats * bins_per_sweep
+    if countrate.shape[1] < n_needed:
+        print("\nERROR:")
+        print(f"Need {n_needed} values for {dimX} matrix rows, but only got {countrate.shape[1]} values")
+        raise IndexError(f"index {countrate.shape[1]} is out of bounds for countrate with size {countrate.shape[1]}")
+
+    sweeps = countrate[:, :n_needed].reshape(len(countrate), dimX, sweep_repeats, bins_per_sweep)
+    starts = np.minimum(pixel_edges[:-1], bins_per_sweep - 1)
+    sweep_rows = np.add.reduceat(sweeps, starts, axis=3).astype(np.float32)     # (frames, dimX, sweeps, dimY)
+    sweep_rows[..., pixel_edges[:-1] == pixel_edges[1:]] = 0    # note: reduceat gives one bin instead of 0 for pixels without bins
+
+    return sweep_rows[:, :, 0, :] + np.flip(sweep_rows[:, :, 1, :], axis=-1)
+
+def get_overlap_matrix(dimY, ampY, frequency, bins, binsize, lag_ps=0):
+    """ returns sparse (bins x dimY) matrix as (bin, pixel, weight) arrays sorted by pixel, weight = part of the bin inside the pixel """
+    # NOTE: instead of giving each whole bin to one pixel, every bin is split between the pixels it overlaps (in time),
+    #   so no counts are lost or moved when pixel edges fall inside a bin. Both sweeps of a row are included (second one flipped).
+    half_period = 1 / (2 * frequency)
+    pixel_times, _ = get_t_of_y(res=dimY + 1, ampY=ampY, frequency=frequency)   # dimY pixels --> dimY+1 pixel edges
+    sweep_edge_times = [pixel_times, np.flip(pixel_times) + half_period]       # time at each pixel edge, in position order
+    return get_overlap_matrix_from_times([times + lag_ps for times in sweep_edge_times], bins, binsize)
+
+def get_overlap_matrix_from_times(sweep_edge_times, bins, binsize):
+    """ same as get_overlap_matrix(), for any sweeps given as times (ps, from row start) at each pixel edge (in position order) """
+    dimY = len(sweep_edge_times[0]) - 1
+    bin_times = np.arange(bins + 1) * binsize
+
+    all_bins, all_pixels, all_weights = [], [], []
+    for edge_times in sweep_edge_times:
+        backwards = edge_times[0] > edge_times[-1]     # sweep goes from last to first pixel
+        pixel_edges = np.flip(edge_times) if backwards else np.asarray(edge_times)
+        # cut the time axis at every bin edge and every pixel edge --> each piece is inside one bin and one pixel
+        cuts = np.unique(np.concatenate([bin_times, pixel_edges]))
+        cuts = cuts[(cuts >= pixel_edges[0]) & (cuts <= pixel_edges[-1])]
+        middle = (cuts[:-1] + cuts[1:]) / 2
+        bin_nr = np.floor(middle / binsize).astype(np.int64)
+        pixel_nr = np.searchsorted(pixel_edges, middle, side='right') - 1
+        keep = (bin_nr >= 0) & (bin_nr < bins) & (pixel_nr >= 0) & (pixel_nr < dimY) & (cuts[1:] > cuts[:-1])
+        if backwards:
+            pixel_nr = dimY - 1 - pixel_nr   # second sweep goes the other way
+        all_bins.append(bin_nr[keep])
+        all_pixels.append(pixel_nr[keep])
+        all_weights.append((cuts[1:] - cuts[:-1])[keep] / binsize)
+
+    bin_nr, pixel_nr, weights = np.concatenate(all_bins), np.concatenate(all_pixels), np.concatenate(all_weights)
+    order = np.argsort(pixel_nr, kind='stable')
+    return bin_nr[order], pixel_nr[order], weights[order]
+
+def resample_area_weighted(frames, plan, dimY):
+    """ area weighted speed adjustment: (frames, dimX, bins) counts --> (frames, dimX, dimY) image, one row at a time """
+    # note: same as rows @ overlap_matrix, done with one gather and one np.add.reduceat over all rows of all frames
+    frames = np.asarray(frames)
+    rows = frames.reshape(-1, frames.shape[-1]).astype(np.float32, copy=False)   # note: float32 before the gather, uint32 * float32 gives float64
+    bin_nr, pixel_nr, weights = plan["overlap_bins"], plan["overlap_pixels"], plan["overlap_weights"]
+
+    pixel_starts = np.searchsorted(pixel_nr, np.arange(dimY))
+    empty = pixel_starts == np.append(pixel_starts[1:], len(pixel_nr))
+    gathered = rows[:, bin_nr]
+    gathered *= weights.astype(np.float32)    # in place, so only one (rows, nnz) float32 array
+    image = np.add.reduceat(gathered, np.minimum(pixel_starts, len(pixel_nr) - 1), axis=1)
+    image[:, empty] = 0
+    return image.reshape(frames.shape[:-1] + (dimY,))
+
+def speed_adjust_with_plan(frames, plan, const):
+    """ speed adjustment of (frames, dimX, bins) with const["resample_mode"]: "bins" (whole bins, default) or "area" (split bins) """
+    # note: sweep alignment (const["align_sweeps"]) shifts the overlap matrix, so it always uses "area"
+    if const.get("resample_mode", "bins") == "area" or const.get("align_sweeps", False):
+        return resample_area_weighted(frames, plan, const["dimY"])
+    return speed_adjust_frames(frames, plan["pixel_edges"], const["dimX"])
+
+def speed_adjusted_matrix_timebased_loop(countrate_matrix, t_from_even_y, const):
+    """ original (slow) version of speed_adjusted_matrix_timebased(), kept to double check results """
     new_matrix = []
     count_idx = 0
     total_time = 0
@@ -517,13 +998,441 @@ def get_t_of_y(res, ampY, frequency):
     # res == resolution
     # ----------------
     y_even_spaced = np.linspace(start=-ampY, stop=ampY, num=res, endpoint=True)
-    t_from_even = []
-    for y_i in y_even_spaced:
-        # get time that corresponds to sine value y_i:
-        t_i = (np.arcsin(y_i / ampY) + (np.pi / 2)) / (2 * np.pi * frequency)
-        t_from_even.append(t_i)
+    # get time that corresponds to each sine value y_i (all at once):
+    t_from_even = (np.arcsin(y_even_spaced / ampY) + (np.pi / 2)) / (2 * np.pi * frequency)
     return t_from_even, y_even_spaced
 
+# ----------- RESAMPLING PLANS (CACHED) --------------
+"""
+A plan holds everything we calculate from the scan geometry (pixel times, bin --> pixel map), and not from the data.
+Almost all our scans use the same geometry, so plans are kept in memory (LRU cache) and can also be saved to disk
+with const["plan_cache_dir"] = "Analysis/plans" (then they are reused between runs of the program).
+"""
+PLAN_CACHE_SIZE = 16    # nr of plans kept in memory
+PLAN_ARRAYS = ["t_from_even_y", "y_even_spaced", "pixel_edges", "overlap_bins", "overlap_pixels", "overlap_weights"]
+
+def get_plan_key(const, lag_ps=0):
+    """ returns the scan geometry that a plan depends on """
+    # note: if we have the exact waveform sent to the galvo (const["sine_values"], const["b_scanRate"]), the plan is built from it
+    sine_values = const.get("sine_values")
+    waveform = tuple(float(val) for val in sine_values) if sine_values is not None and len(sine_values) > 0 else None
+    scan_rate = const.get("b_scanRate") if waveform is not None else None
+    return (const["dimY"], const["ampY"], const["freq"], const["bins"], const["binsize"], const.get("sweep_mode", "sine"), waveform, scan_rate,
+            int(round(lag_ps)))
+
+def get_resampling_plan(const, lag_ps=0):
+    """ returns the (cached) resampling plan for the scan geometry in const. lag_ps = sweep lag correction, see get_aligned_plan() """
+    return load_resampling_plan(get_plan_key(const, lag_ps), const.get("plan_cache_dir"))
+
+def build_resampling_plan(dimY, ampY, freq, bins, binsize, sweep_mode="sine", sine_values=None, scan_rate=None, lag_ps=0):
+    """ calculates a resampling plan. Arrays are read only, since the same plan is shared between analyses """
+    if sine_values is None and sweep_mode == "linear":
+        # no recorded waveform, so we make the same linear buffer values as the GUI does
+        sine_values, scan_rate = get_default_waveform(sweep_mode, ampY, freq)
+
+    if sine_values is None:
+        # sine sweep, inverted with arcsin
+        t_from_even_y, y_even_spaced = get_t_of_y(res=dimY, ampY=ampY, frequency=freq * 1e-12)   # note: freq_ps like in the GUI
+        overlap_bins, overlap_pixels, overlap_weights = get_overlap_matrix(dimY, ampY, freq * 1e-12, bins, binsize, lag_ps)
+    else:
+        # any sweep shape, inverted numerically from the waveform
+        t_from_even_y, _, y_even_spaced = get_waveform_pixel_times(sine_values, scan_rate, n_edges=dimY)
+        rising_times, falling_times, _ = get_waveform_pixel_times(sine_values, scan_rate, n_edges=dimY + 1)
+        overlap_bins, overlap_pixels, overlap_weights = get_overlap_matrix_from_times([rising_times + lag_ps, falling_times + lag_ps], bins, binsize)
+    plan = {
+        "t_from_even_y": t_from_even_y,
+        "y_even_spaced": y_even_spaced,
+        "pixel_edges": get_pixel_bin_edges(t_from_even_y, binsize),
+        "overlap_bins": overlap_bins,
+        "overlap_pixels": overlap_pixels,
+        "overlap_weights": overlap_weights,
+    }
+    for arr in plan.values():
+        arr.flags.writeable = False
+    plan["key"] = (dimY, ampY, freq, bins, binsize, sweep_mode, None if sine_values is None else tuple(sine_values), scan_rate, lag_ps)
+    return plan
+
+def get_default_waveform(sweep_mode, amp, freq, sine_dim=256):
+    """ returns (buffer values, scan rate) for one period, the same way as T7.get_sine_values() in the GUI (without offset) """
+    period = 1 / freq
+    scan_rate = int(sine_dim / period)
+    if sweep_mode == "linear":
+        half_lin_values = np.around(np.linspace(start=-amp, stop=amp, num=int(sine_dim / 2), endpoint=True), decimals=10)
+        return tuple(half_lin_values) + tuple(np.flip(half_lin_values)), scan_rate
+    sine_times = np.arange(sine_dim) * (period / sine_dim)
+    return tuple(np.around(amp * np.sin(2 * np.pi * freq * sine_times - np.pi / 2), decimals=10)), scan_rate
+
+def get_waveform_pixel_times(sine_values, scan_rate, n_edges):
+    """ returns (rising times, falling times, positions): time (ps, from period start) when the waveform passes n_edges evenly spaced positions """
+    # NOTE: sample k of the buffer is sent at k/scan_rate and the buffer repeats, so the period ends with the first value again.
+    #   Between samples we assume the position moves linearly. Works for any sweep shape that goes up once and down once per period.
+    values = np.asarray(sine_values, dtype=np.float64)
+    positions = np.linspace(values.min(), values.max(), n_edges)
+
+    i_min = int(np.argmin(values))   # note: 0 for the GUI waveforms, they start at the lowest value
+    values = np.roll(values, -i_min)
+    values = np.append(values, values[0])
+    times = (i_min + np.arange(len(values))) * (1e12 / scan_rate)
+
+    first_max = int(np.argmax(values))
+    last_max = len(values) - 1 - int(np.argmax(values[::-1]))
+    rising = np.interp(positions, np.maximum.accumulate(values[:first_max + 1]), times[:first_max + 1])
+    falling = np.interp(positions, np.maximum.accumulate(values[last_max:][::-1]), times[last_max:][::-1])
+    return rising, falling, positions
+
+def get_plan_path(key, cache_dir):
+    return Path(cache_dir).joinpath(f"plan_{hashlib.sha1(repr(key).encode()).hexdigest()[:16]}.npz")
+
+@functools.lru_cache(maxsize=PLAN_CACHE_SIZE)
+def load_resampling_plan(key, cache_dir=None):
+    """ returns the plan for a key: from memory, from disk (if cache_dir is given and it was saved before) or newly built """
+    if cache_dir is not None:
+        plan_path = get_plan_path(key, cache_dir)
+        if plan_path.exists():
+            with np.load(plan_path) as saved:
+                # note: key check guards against hash collisions, name check against plans saved by older versions
+                if str(saved["key"]) == repr(key) and all(name in saved for name in PLAN_ARRAYS):
+                    plan = {name: saved[name] for name in PLAN_ARRAYS}
+                    for arr in plan.values():
+                        arr.flags.writeable = False
+                    plan["key"] = key
+                    return plan
+
+    plan = build_resampling_plan(*key)
+
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(get_plan_path(key, cache_dir), "wb") as file:   # note: file handle, otherwise numpy adds ".npz"
+            np.savez(file, key=np.array(repr(key)), **{name: plan[name] for name in PLAN_ARRAYS})
+    return plan
+
+def clear_plan_cache():
+    """ empties the in-memory plan cache (saved plans on disk are kept) """
+    load_resampling_plan.cache_clear()
+
+# ----------- SWEEP ALIGNMENT --------------
+"""
+If the galvo lags behind the waveform, the forward and backward sweep of a row are shifted in opposite directions
+and edges show up twice in the combined image (before this we fixed it by hand with "extra_delay").
+With const["align_sweeps"] = True the lag is measured on the first frame and the pixel edge times in the plan are shifted by it.
+The lag can also be given directly with const["sweep_lag_ps"].
+"""
+
+def estimate_sweep_lag(frame, binsize):
+    """ returns how much (ps) the sweeps lag behind the waveform, from cross-correlating forward and backward sweeps of all rows """
+    # NOTE: frame must be in time order (not flipped). For a symmetric sweep, the reversed backward sweep equals the forward sweep
+    #   shifted by -2*lag, so we find the shift with the largest correlation (FFT, all rows summed) and divide by 2
+    frame = np.asarray(frame, dtype=np.float64)
+    half = frame.shape[-1] // 2
+    forward = frame[:, :half] - frame[:, :half].mean(axis=1, keepdims=True)
+    backward = frame[:, 2 * half - 1:half - 1:-1] - frame[:, half:2 * half].mean(axis=1, keepdims=True)
+
+    n = 2 * half    # zero padded, so the correlation doesn't wrap around
+    cross = np.fft.irfft((np.conj(np.fft.rfft(forward, n)) * np.fft.rfft(backward, n)).sum(axis=0), n)
+    shift = int(np.argmax(cross))
+
+    # sub-bin peak position from a parabola through the peak and its neighbours
+    y0, y1, y2 = cross[shift - 1], cross[shift], cross[(shift + 1) % n]
+    curve = y0 - 2 * y1 + y2
+    fine = 0.5 * (y0 - y2) / curve if curve != 0 else 0.0
+    if shift > n // 2:
+        shift -= n
+    return -(shift + fine) / 2 * binsize
+
+def get_aligned_plan(const, frame, flipped=False):
+    """ returns the resampling plan for a frame, with the sweep lag correction if const["align_sweeps"] is set """
+    if not const.get("align_sweeps", False):
+        return get_resampling_plan(const)
+    # note: flipped frames (np.flip on both axes) are reversed in time, so the lag goes the other way
+    if const.get("sweep_lag_ps") is None:
+        const["sweep_lag_ps"] = estimate_sweep_lag(frame[::-1, ::-1] if flipped else frame, const["binsize"])
+        print(f"Sweep lag: {const['sweep_lag_ps']:.0f} ps ({const['sweep_lag_ps'] / const['binsize']:.2f} bins)")
+    return get_resampling_plan(const, lag_ps=-const["sweep_lag_ps"] if flipped else const["sweep_lag_ps"])
+
+# ----------- DIRECT BINNING (NO ETA HISTOGRAMS) --------------
+"""
+Instead of letting ETA histogram every row into 'bins' time bins and then summing the bins into pixels, each photon is put
+straight into its pixel: time since the row's start marker --> sweep position --> pixel, then one np.bincount per chunk.
+Photons keep their exact timestamp, so the result no longer depends on bins/binsize (those are only used for the lag estimate).
+The image is the same as the "area" resampling of a histogram with very small bins.
+
+all_figs = Q.direct_analysis_multiframe(const)     # same images and files as bap_eta_segmented_analysis_multiframe()
+"""
+
+def get_photon_channel(const):
+    """ returns the timetagger channel we image, const["photon_channel"] or from const["ch_sel"] (ex: 'h2' --> channel 2) """
+    if const.get("photon_channel") is not None:
+        return int(const["photon_channel"])
+    return get_channel_number(const["ch_sel"])
+
+def get_channel_number(name):
+    """ ETA histogram name --> timetagger channel (ex: 'h2' --> 2) """
+    return int(str(name).lstrip("h"))   # note: ETA histogram hN records channel N in our recipes
+
+def get_channel_names(const):
+    """ returns the channels we image: const["channels"] (ex: ["h1", "h2", "h3", "h4"]) or only const["ch_sel"] """
+    return list(const.get("channels") or [const["ch_sel"]])
+
+def get_sweep_position(t_ps, const):
+    """ returns (position, (lowest, highest) position) of the sweep at times (ps) since the row started """
+    sine_values, scan_rate = const.get("sine_values"), const.get("b_scanRate")
+    if sine_values is None or len(sine_values) == 0:
+        if const.get("sweep_mode", "sine") != "linear":
+            # sine with the same phase as the GUI waveform: ampY * sin(2*pi*f*t - pi/2)
+            return -const["ampY"] * np.cos(2 * np.pi * const["freq"] * 1e-12 * t_ps), (-const["ampY"], const["ampY"])
+        sine_values, scan_rate = get_default_waveform("linear", const["ampY"], const["freq"])
+    # NOTE: same as get_waveform_pixel_times(): sample k is sent at k/scan_rate, linear in between, and the buffer repeats
+    values = np.asarray(sine_values, dtype=np.float64)
+    times = np.arange(len(values) + 1) * (1e12 / scan_rate)
+    return np.interp(np.mod(t_ps, times[-1]), times, np.append(values, values[0])), (values.min(), values.max())
+
+def get_pixel_of_time(t_ps, const, lag_ps=0):
+    """ returns the speed adjusted pixel (evenly spaced positions) for times (ps) since the row started """
+    position, (low, high) = get_sweep_position(np.asarray(t_ps, dtype=np.float64) - lag_ps, const)
+    pixel = np.floor((position - low) / (high - low) * const["dimY"]).astype(np.int64)
+    return np.clip(pixel, 0, const["dimY"] - 1)   # note: the turning points land exactly on the outer edges
+
+def get_raw_pixel_of_time(t_ps, const):
+    """ returns the non-speed adjusted pixel (evenly spaced times), both sweeps folded on top of each other like build_image_matrix() """
+    half_period = 0.5e12 / const["freq"]
+    folded = np.where(t_ps < half_period, t_ps, 2 * half_period - t_ps)
+    return np.clip((folded * (const["dimY"] / half_period)).astype(np.int64), 0, const["dimY"] - 1)
+
+def iter_row_photons(const, first_row, n_rows, chunk_size=TR.DEFAULT_CHUNK, sync_channel=None, photon_channels=None):
+    """ yields (row nr from first_row, time in ps since the row's sweep started, time in ps since the last sync, channel nr) for the photons
+    of rows first_row..first_row+n_rows, one chunk at a time. Time since sync is None if no sync_channel is given.
+    channel nr = position in photon_channels (default: only the channel from get_photon_channel()) """
+    # NOTE: markers are on const["marker_channels"] (default TR.MARKER_CHANNELS, files from the GUI have them on channel 4)
+    #   Same logic as the ETA recipe: a row starts at its second marker and ends at the first marker of the next row,
+    #   and only one sine period is used (the rest of the row is the step to the next row)
+    markers = TR.load_marker_index(const["timetag_file"], marker_channels=const.get("marker_channels", TR.MARKER_CHANNELS))
+    n_file_rows = TR.get_nr_rows(markers)
+    row_first_index = markers['index'][0:n_file_rows * TR.MARKERS_PER_ROW:TR.MARKERS_PER_ROW]
+    row_start_time = markers['timestamp'][TR.ROW_START_MARKER:n_file_rows * TR.MARKERS_PER_ROW:TR.MARKERS_PER_ROW]
+    if first_row >= n_file_rows:
+        print(f"CAUTION: file only has {n_file_rows} rows, can't start at row {first_row}")
+        return
+    if first_row + n_rows > n_file_rows:
+        print(f"CAUTION: file only has {n_file_rows} rows, missing rows are left empty")
+    n_rows = min(n_rows, n_file_rows - first_row)
+    start = int(row_first_index[first_row])
+    stop = int(markers['index'][(first_row + n_rows) * TR.MARKERS_PER_ROW]) if (first_row + n_rows) * TR.MARKERS_PER_ROW < len(markers) else None
+
+    period_ps = 1e12 / const["freq"]
+    if photon_channels is None:
+        photon_channels = [get_photon_channel(const)]
+    last_sync = np.zeros(0, dtype=np.int64)    # last sync of the previous chunk, for photons before the first sync in a chunk
+    for chunk_start, chunk in TR.iter_chunks(const["timetag_file"], chunk_size=chunk_size, start=start, stop=stop):
+        hits = np.flatnonzero(np.isin(chunk['channel'], photon_channels))
+        rows = np.searchsorted(row_first_index, hits + chunk_start, side='right') - 1
+        t_ps = chunk['timestamp'][hits] - row_start_time[np.maximum(rows, 0)]
+        keep = (rows >= first_row) & (rows < first_row + n_rows) & (t_ps >= 0) & (t_ps < period_ps)
+
+        tof_ps = None
+        if sync_channel is not None:
+            # NOTE: timestamps are sorted, so the last sync before each photon is found with one searchsorted
+            sync_times = np.concatenate([last_sync, chunk['timestamp'][chunk['channel'] == sync_channel]])
+            sync_nr = np.searchsorted(sync_times, chunk['timestamp'][hits], side='right') - 1
+            tof_ps = chunk['timestamp'][hits] - sync_times[np.maximum(sync_nr, 0)]
+            keep &= sync_nr >= 0      # note: photons before the first sync are dropped
+            last_sync = sync_times[-1:]
+            tof_ps = tof_ps[keep]
+
+        channel_nr = np.zeros(len(hits), dtype=np.int64)
+        for i, channel in enumerate(photon_channels[1:], start=1):
+            channel_nr[chunk['channel'][hits] == channel] = i
+        yield rows[keep] - first_row, t_ps[keep], tof_ps, channel_nr[keep]
+
+def histogram_frame_direct(const, frame_nr=0):
+    """ returns the (dimX, bins) time histogram of one frame (frame numbers start at 0, not flipped), like the rows we get from ETA """
+    dimX, bins = const["dimX"], const["bins"]
+    counts = np.zeros(dimX * bins, dtype=np.int64)
+    for rows, t_ps, _, _ in iter_row_photons(const, frame_nr * dimX, dimX):
+        bin_nr = (t_ps // const["binsize"]).astype(np.int64)
+        inside = bin_nr < bins
+        counts += np.bincount(rows[inside] * bins + bin_nr[inside], minlength=len(counts))
+    return counts.reshape(dimX, bins)
+
+def bin_photons_into_frames(const, first_frame=0, n_frames=1, chunk_size=TR.DEFAULT_CHUNK):
+    """ returns (speed adjusted, non-speed adjusted) images of shape (n_frames, dimX, dimY), straight from the photon timestamps """
+    adjusted, raw = bin_photons_into_channel_frames(const, first_frame, n_frames, photon_channels=[get_photon_channel(const)], chunk_size=chunk_size)
+    return adjusted[:, 0], raw[:, 0]
+
+def bin_photons_into_channel_frames(const, first_frame=0, n_frames=1, photon_channels=None, chunk_size=TR.DEFAULT_CHUNK):
+    """ same as bin_photons_into_frames() for several channels in one pass over the file --> (n_frames, channels, dimX, dimY) images.
+    Default channels: const["channels"] """
+    if photon_channels is None:
+        photon_channels = [get_channel_number(name) for name in get_channel_names(const)]
+    dimX, dimY, n_channels = const["dimX"], const["dimY"], len(photon_channels)
+    lag_ps = const["sweep_lag_ps"] if const.get("align_sweeps", False) and const.get("sweep_lag_ps") is not None else 0
+    adjusted = np.zeros(n_frames * n_channels * dimX * dimY, dtype=np.int64)
+    raw = np.zeros(n_frames * n_channels * dimX * dimY, dtype=np.int64)
+
+    for rows, t_ps, _, channel_nr in iter_row_photons(const, first_frame * dimX, n_frames * dimX, chunk_size=chunk_size, photon_channels=photon_channels):
+        frame, row_nr = rows // dimX, rows % dimX
+        # every odd frame is flipped since we scan in different directions (image_nr starts at 1, like in the ETA analysis).
+        #   note: flipping time within a row doesn't move a photon's position, so only the row order changes
+        flipped = is_flipped_frame(first_frame + frame + 1, const)
+        row_nr = np.where(flipped, dimX - 1 - row_nr, row_nr)
+        row_offset = ((frame * n_channels + channel_nr) * dimX + row_nr) * dimY
+        adjusted += np.bincount(row_offset + get_pixel_of_time(t_ps, const, lag_ps), minlength=len(adjusted))
+        raw += np.bincount(row_offset + get_raw_pixel_of_time(t_ps, const), minlength=len(raw))
+
+    shape = (n_frames, n_channels, dimX, dimY)
+    return adjusted.reshape(shape).astype(np.float32), raw.reshape(shape).astype(np.float32)
+
+
+# ----------- LIVE DIRECT BINNING (WHILE THE FILE IS WRITTEN) --------------
+"""
+The direct binning only needs the photons of one row at a time, so it can run while the timetagger is still writing the file:
+TR.follow_rows() hands over each row as soon as the next row's first marker has arrived, and a frame is done after dimX rows.
+
+all_figs = Q.direct_analysis_multiframe(const, live=True)      # start right after starting the scan
+const["live_timeout"] = 10      # s without new data before we stop waiting (default 10)
+NOTE: the sweep lag can't be measured before the first frame is in, so with align_sweeps give const["sweep_lag_ps"] (ex: from an earlier scan)
+"""
+
+def get_row_photon_times(row_records, const, photon_channel):
+    """ returns the times (ps since the sweep started) of the photons in one row's records, same as iter_row_photons() """
+    marker_times = row_records['timestamp'][np.isin(row_records['channel'], const.get("marker_channels", TR.MARKER_CHANNELS))]
+    if len(marker_times) <= TR.ROW_START_MARKER:
+        return np.zeros(0, dtype=np.int64)   # note: row was cut before its sweep started
+    t_ps = row_records['timestamp'][row_records['channel'] == photon_channel] - marker_times[TR.ROW_START_MARKER]
+    return t_ps[(t_ps >= 0) & (t_ps < 1e12 / const["freq"])]
+
+def iter_live_frames(const, first_frame=0, n_frames=1):
+    """ yields (frame nr from first_frame, speed adjusted image, non-speed adjusted image) for each frame as soon as all its rows are written """
+    dimX, dimY = const["dimX"], const["dimY"]
+    photon_channel = get_photon_channel(const)
+    lag_ps = const["sweep_lag_ps"] if const.get("align_sweeps", False) and const.get("sweep_lag_ps") is not None else 0
+    adjusted = np.zeros(dimX * dimY, dtype=np.int64)
+    raw = np.zeros(dimX * dimY, dtype=np.int64)
+
+    n_rows = 0
+    for row_nr, row_records in TR.follow_rows(const["timetag_file"], expected_rows=(first_frame + n_frames) * dimX,
+                                              marker_channels=const.get("marker_channels", TR.MARKER_CHANNELS),
+                                              timeout=const.get("live_timeout", 10.0), settle_time=2 / const["freq"]):
+        frame, row_in_frame = divmod(row_nr, dimX)
+        if frame < first_frame:
+            continue
+        if frame >= first_frame + n_frames:
+            break
+        if is_flipped_frame(frame + 1, const):   # same flipping as in bin_photons_into_frames()
+            row_in_frame = dimX - 1 - row_in_frame
+
+        t_ps = get_row_photon_times(row_records, const, photon_channel)
+        adjusted += np.bincount(row_in_frame * dimY + get_pixel_of_time(t_ps, const, lag_ps), minlength=len(adjusted))
+        raw += np.bincount(row_in_frame * dimY + get_raw_pixel_of_time(t_ps, const), minlength=len(raw))
+        n_rows += 1
+
+        if n_rows == dimX:
+            print(f"Frame {frame + 1}/{const['nr_frames']} complete!")
+            yield frame - first_frame, adjusted.reshape(dimX, dimY).astype(np.float32), raw.reshape(dimX, dimY).astype(np.float32)
+            adjusted[:] = 0
+            raw[:] = 0
+            n_rows = 0
+
+    if n_rows > 0:
+        print(f"CAUTION: scan stopped, last frame only has {n_rows}/{dimX} rows")
+
+
+# ----------- TIME OF FLIGHT (PER PIXEL HISTOGRAMS) --------------
+"""
+For ToF/lifetime scans (ex: 'ToF_terra_10MHz_det2_...') every photon also gets its time since the last laser sync,
+so we get one arrival time histogram per pixel: a (dimX, dimY, tof_bins) cube, summed over all frames.
+Most cells of the cube are empty (few photons per pixel, thousands of tof bins), so it is kept sparse (COO):
+    cube["index"]  --> flat cube index of every non-empty cell (sorted),  cube["counts"] --> photons in that cell
+Gated images, decay curves and lifetime maps are all made from the cube, without reading the file again.
+
+const["sync_channel"] = 1       # laser sync input (default 1)
+const["sync_freq"] = 10e6       # laser rep rate (Hz), sets the tof range if const["tof_bins"] is not given
+const["tof_binsize"] = 100      # ps
+"""
+
+def merge_sparse_counts(index, counts, new_index):
+    """ adds events (flat cube indices) to sparse (sorted index, counts) arrays. Returns the new (index, counts) """
+    new_unique, new_counts = np.unique(new_index, return_counts=True)
+    merged, inverse = np.unique(np.concatenate([index, new_unique]), return_inverse=True)
+    merged_counts = np.bincount(inverse, weights=np.concatenate([counts, new_counts]), minlength=len(merged))
+    return merged, merged_counts.astype(np.int64)
+
+def build_tof_cube(const, first_frame=0, n_frames=1, chunk_size=TR.DEFAULT_CHUNK):
+    """ returns the sparse (dimX, dimY, tof_bins) time of flight cube of frames first_frame..first_frame+n_frames (summed) """
+    dimX, dimY = const["dimX"], const["dimY"]
+    tof_binsize = int(const.get("tof_binsize", 100))
+    tof_bins = int(const.get("tof_bins") or np.ceil(1e12 / const.get("sync_freq", 10e6) / tof_binsize))
+    lag_ps = const["sweep_lag_ps"] if const.get("align_sweeps", False) and const.get("sweep_lag_ps") is not None else 0
+
+    index = np.zeros(0, dtype=np.int64)
+    counts = np.zeros(0, dtype=np.int64)
+    for rows, t_ps, tof_ps, _ in iter_row_photons(const, first_frame * dimX, n_frames * dimX, chunk_size=chunk_size,
+                                               sync_channel=const.get("sync_channel", 1)):
+        frame, row_nr = rows // dimX, rows % dimX
+        flipped = is_flipped_frame(first_frame + frame + 1, const)    # same flipping as in bin_photons_into_frames()
+        row_nr = np.where(flipped, dimX - 1 - row_nr, row_nr)
+        tof_bin = tof_ps // tof_binsize
+        inside = tof_bin < tof_bins
+        pixel_nr = row_nr * dimY + get_pixel_of_time(t_ps, const, lag_ps)
+        index, counts = merge_sparse_counts(index, counts, (pixel_nr * tof_bins + tof_bin)[inside])
+
+    return {"shape": (dimX, dimY, tof_bins), "tof_binsize": tof_binsize, "index": index, "counts": counts}
+
+def get_dense_tof_cube(cube):
+    """ returns the full (dimX, dimY, tof_bins) array. NOTE: can be large (100x100 pixels, 1000 tof bins --> 40 MB) """
+    dense = np.zeros(int(np.prod(cube["shape"])), dtype=np.uint32)
+    dense[cube["index"]] = cube["counts"]
+    return dense.reshape(cube["shape"])
+
+def get_gated_image(cube, tof_start_ps=0, tof_stop_ps=None):
+    """ returns the (dimX, dimY) image of photons arriving tof_start_ps <= time since sync < tof_stop_ps (default: all photons) """
+    dimX, dimY, tof_bins = cube["shape"]
+    tof_times = (cube["index"] % tof_bins) * cube["tof_binsize"]    # note: start of each tof bin
+    gate = tof_times >= tof_start_ps
+    if tof_stop_ps is not None:
+        gate &= tof_times < tof_stop_ps
+    image = np.bincount(cube["index"][gate] // tof_bins, weights=cube["counts"][gate], minlength=dimX * dimY)
+    return image.reshape(dimX, dimY).astype(np.float32)
+
+def get_tof_histogram(cube, row=None, pixel=None):
+    """ returns the arrival time histogram (tof_bins) of one pixel, or of the whole image if no pixel is given """
+    dimX, dimY, tof_bins = cube["shape"]
+    index, counts = cube["index"], cube["counts"]
+    if row is not None and pixel is not None:
+        first, last = np.searchsorted(index, [(row * dimY + pixel) * tof_bins, (row * dimY + pixel + 1) * tof_bins])
+        index, counts = index[first:last], counts[first:last]
+    return np.bincount(index % tof_bins, weights=counts, minlength=tof_bins).astype(np.int64)
+
+def get_lifetime_map(cube, tof_start_ps=None, tof_stop_ps=None, min_counts=20):
+    """ returns the (dimX, dimY) lifetime (ps) of each pixel, from the mean arrival time after tof_start_ps (default: peak of the decay) """
+    # NOTE: for a single exponential decay, the mean time after the start is the lifetime (first moment method).
+    #   Fast and needs no fitting, but background counts and a tof range shorter than ~5 lifetimes make it too short.
+    #   Pixels with less than min_counts photons are NaN
+    dimX, dimY, tof_bins = cube["shape"]
+    if tof_start_ps is None:
+        tof_start_ps = int(np.argmax(get_tof_histogram(cube))) * cube["tof_binsize"]
+    tof_times = (cube["index"] % tof_bins + 0.5) * cube["tof_binsize"]   # note: middle of each tof bin
+    gate = tof_times >= tof_start_ps
+    if tof_stop_ps is not None:
+        gate &= tof_times < tof_stop_ps
+
+    pixel_nr, counts = cube["index"][gate] // tof_bins, cube["counts"][gate]
+    n_photons = np.bincount(pixel_nr, weights=counts, minlength=dimX * dimY)
+    summed_delay = np.bincount(pixel_nr, weights=counts * (tof_times[gate] - tof_start_ps), minlength=dimX * dimY)
+    lifetime = np.full(dimX * dimY, np.nan)
+    enough = n_photons >= min_counts
+    lifetime[enough] = summed_delay[enough] / n_photons[enough]
+    return lifetime.reshape(dimX, dimY)
+
+def save_tof_cube(cube, path):
+    """ saves a sparse cube (.npz) so we can make more gated images/lifetime maps later """
+    with open(path, "wb") as file:   # note: file handle, otherwise numpy adds ".npz"
+        np.savez(file, shape=np.array(cube["shape"]), tof_binsize=cube["tof_binsize"], index=cube["index"], counts=cube["counts"])
+
+def load_tof_cube(path):
+    with np.load(path) as saved:
+        return {"shape": tuple(int(n) for n in saved["shape"]), "tof_binsize": int(saved["tof_binsize"]), "index": saved["index"], "counts": saved["counts"]}
+
+
 """
 def y_velocity(ampY, yfreq, time):
     # NOTE: previously called "yVelocity()"
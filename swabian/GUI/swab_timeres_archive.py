@@ -0,0 +1,184 @@
+# Packages for compressing timetag files
+import json
+import lzma
+import struct
+import time
+import zlib
+from pathlib import Path
+import numpy as np
+
+import swab_timeres_lib as TR
+
+
+"""
+COMPACT ARCHIVE FORMAT (".trz") FOR TIMERES DATA:
+
+    b'TRZ1'                                 <-- magic
+    [chunk 0][chunk 1] ... [chunk n]        <-- each chunk compressed on its own (zlib or lzma)
+    [footer json]                           <-- chunk index: offset, size, nr of records and first timestamp for each chunk
+    [footer size (uint64)] b'TRZ1'
+
+    One chunk (before compression), columns after each other:
+        channel codes  --> uint8, index into the file's channel table (ex: table [-1, 2, 101] --> channel 101 has code 2)
+        time deltas    --> difference between consecutive timestamps, smallest uint that fits (int64 if not increasing)
+        header words   --> uint32 (almost always zero, compresses to nothing)
+
+USAGE:
+import swab_timeres_archive as TA
+TA.compress_timeres('Data/scan.timeres')                # --> Data/scan.trz
+for start, chunk in TA.iter_archive_chunks('Data/scan.trz'):
+    ...                                                 # same structured arrays as TR.iter_chunks()
+TA.decompress_archive('Data/scan.trz', 'Data/scan_restored.timeres')    # identical to original file
+"""
+
+MAGIC = b'TRZ1'
+ARCHIVE_SUFFIX = ".trz"
+FOOTER_END = struct.Struct('<Q4s')      # footer size + magic
+COMPRESSORS = {
+    'zlib': (zlib.compress, zlib.decompress),
+    'lzma': (lzma.compress, lzma.decompress),
+}
+DELTA_DTYPES = [np.dtype('<u1'), np.dtype('<u2'), np.dtype('<u4'), np.dtype('<u8')]
+
+
+# ----------- WRITING --------------
+def get_delta_dtype(deltas):
+    """ returns smallest dtype that can hold all time deltas of a chunk """
+    if len(deltas) == 0:
+        return DELTA_DTYPES[0]
+    if deltas.min() < 0:
+        return np.dtype('<i8')   # timestamps going backwards, keep full signed deltas
+    for dtype in DELTA_DTYPES:
+        if deltas.max() <= np.iinfo(dtype).max:
+            return dtype
+
+def encode_chunk(chunk, codes, method='zlib', level=None):
+    """ returns (compressed bytes, chunk info) for one chunk of records. 'codes' = channel code (uint8) for each record """
+    compress, _ = COMPRESSORS[method]
+
+    deltas = np.diff(chunk['timestamp'])
+    delta_dtype = get_delta_dtype(deltas)
+
+    raw = codes.astype(np.uint8).tobytes() + deltas.astype(delta_dtype).tobytes() + chunk['header'].astype('<u4').tobytes()
+    if level is None:
+        blob = compress(raw)
+    elif method == 'zlib':
+        blob = compress(raw, level)
+    else:
+        blob = compress(raw, preset=level)
+
+    info = {
+        "n_records": len(chunk),
+        "t_first": int(chunk['timestamp'][0]),
+        "delta_dtype": delta_dtype.str,
+        "size": len(blob),
+    }
+    return blob, info
+
+def compress_timeres(timetag_file, archive_file=None, chunk_size=TR.DEFAULT_CHUNK, method='zlib', level=None):
+    """ converts a timeres file into the compact archive format. Returns the archive path """
+    if method not in COMPRESSORS:
+        raise ValueError(f"Unknown compression '{method}', use one of {list(COMPRESSORS)}")
+    if archive_file is None:
+        archive_file = Path(timetag_file).with_suffix(ARCHIVE_SUFFIX)
+
+    # first pass: which channels are in the file (needed to store channels as one byte)
+    channels = sorted(TR.count_signals(timetag_file, channels=[], chunk_size=chunk_size))
+    if len(channels) > 256:
+        raise ValueError(f"Too many different channels ({len(channels)}) to store as uint8 codes")
+
+    # lookup table from channel to code, offset so negative channels work as indices
+    lowest = channels[0] if channels else 0
+    code_lut = np.zeros((channels[-1] - lowest + 1) if channels else 1, dtype=np.uint8)
+    for code, ch in enumerate(channels):
+        code_lut[ch - lowest] = code
+
+    t_start = time.time()
+    footer = {"channels": channels, "method": method, "n_records": 0, "chunks": []}
+    with open(archive_file, "wb") as file:
+        file.write(MAGIC)
+        offset = len(MAGIC)
+        for _, chunk in TR.iter_chunks(timetag_file, chunk_size=chunk_size):
+            blob, info = encode_chunk(chunk, code_lut[chunk['channel'] - lowest], method=method, level=level)
+            info["offset"] = offset
+            file.write(blob)
+            offset += len(blob)
+            footer["chunks"].append(info)
+            footer["n_records"] += info["n_records"]
+
+        footer_bytes = json.dumps(footer).encode()
+        file.write(footer_bytes)
+        file.write(FOOTER_END.pack(len(footer_bytes), MAGIC))
+
+    raw_size = footer["n_records"] * TR.RECORD_SIZE
+    print(f"--> Compressed {footer['n_records']} records: {raw_size / 1e6:.1f} MB --> {(offset + len(footer_bytes)) / 1e6:.1f} MB "
+          f"({round(time.time() - t_start, 2)} s)")
+    return Path(archive_file)
+
+
+# ----------- READING --------------
+def read_footer(archive_file):
+    """ returns the footer (chunk index, channel table, ...) of an archive """
+    with open(archive_file, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{archive_file} is not a timeres archive")
+        file.seek(-FOOTER_END.size, 2)
+        footer_size, magic = FOOTER_END.unpack(file.read(FOOTER_END.size))
+        if magic != MAGIC:
+            raise ValueError(f"{archive_file} has no footer (file not completely written?)")
+        file.seek(-FOOTER_END.size - footer_size, 2)
+        return json.loads(file.read(footer_size))
+
+def decode_chunk(blob, info, channel_table, method='zlib'):
+    """ returns the structured TIMERES_DTYPE records of one compressed chunk """
+    _, decompress = COMPRESSORS[method]
+    raw = decompress(blob)
+
+    n = info["n_records"]
+    delta_dtype = np.dtype(info["delta_dtype"])
+    n_delta_bytes = (n - 1) * delta_dtype.itemsize
+
+    codes = np.frombuffer(raw, dtype=np.uint8, count=n)
+    deltas = np.frombuffer(raw, dtype=delta_dtype, count=n - 1, offset=n)
+    headers = np.frombuffer(raw, dtype='<u4', count=n, offset=n + n_delta_bytes)
+
+    records = np.empty(n, dtype=TR.TIMERES_DTYPE)
+    records['header'] = headers
+    records['channel'] = channel_table[codes]
+    records['timestamp'][0] = info["t_first"]
+    np.cumsum(deltas, dtype=np.int64, out=records['timestamp'][1:])
+    records['timestamp'][1:] += info["t_first"]
+    return records
+
+def iter_archive_chunks(archive_file, footer=None):
+    """ yields (index of first record, records) for each chunk, same as TR.iter_chunks() for raw files """
+    if footer is None:
+        footer = read_footer(archive_file)
+    channel_table = np.array(footer["channels"], dtype=np.int32)
+
+    start = 0
+    with open(archive_file, "rb") as file:
+        for info in footer["chunks"]:
+            file.seek(info["offset"])
+            yield start, decode_chunk(file.read(info["size"]), info, channel_table, method=footer["method"])
+            start += info["n_records"]
+
+def read_archive_chunk(archive_file, chunk_nr, footer=None):
+    """ returns the records of a single chunk (random access through the chunk index) """
+    if footer is None:
+        footer = read_footer(archive_file)
+    info = footer["chunks"][chunk_nr]
+    with open(archive_file, "rb") as file:
+        file.seek(info["offset"])
+        blob = file.read(info["size"])
+    return decode_chunk(blob, info, np.array(footer["channels"], dtype=np.int32), method=footer["method"])
+
+def decompress_archive(archive_file, timetag_file):
+    """ writes the archive back out as a normal 16-byte timeres file """
+    t_start = time.time()
+    n_records = 0
+    with open(timetag_file, "wb") as file:
+        for _, records in iter_archive_chunks(archive_file):
+            records.tofile(file)
+            n_records += len(records)
+    TR.print_throughput(n_records, 0, time.time() - t_start)
@@ -0,0 +1,155 @@
+# Packages for keeping track of timeres files
+import os
+import re
+import json
+from pathlib import Path
+
+
+"""
+CATALOG OF TIMERES FILES IN A DATA FOLDER:
+The scan parameters are written into the filename when we save a scan (see "suggest_name()" in the GUI), ex:
+    froggg_sineFreq(5.0)_numFrames(1)_sineAmp(0.3)_stepAmp(0.3)_stepDim(100)_date(240116)_time(09h53m12s).timeres
+
+Each filename is parsed once and saved (with file size and modified time) in "timeres_catalog.json" inside the folder.
+The catalog is updated incrementally: only new or changed files are parsed again, removed files are dropped.
+
+USAGE:
+import swab_timeres_catalog as TC
+entries = TC.find_files('Data/240116/', sineFreq=5, numFrames=1, clue='froggg')     # newest first
+timetag_file = entries[0]['path']
+"""
+
+CATALOG_NAME = "timeres_catalog.json"
+CATALOG_VERSION = 1
+PARAM_PATTERN = re.compile(r"(sineFreq|numFrames|sineAmp|stepAmp|stepDim|date|time)\(([^)]*)\)")
+PARAM_TYPES = {
+    "sineFreq": float,
+    "numFrames": int,
+    "sineAmp": float,
+    "stepAmp": float,
+    "stepDim": int,
+    "date": str,    # yymmdd
+    "time": str,    # ex: 14h48m42s
+}
+
+
+# ----------- PARSING NAMES --------------
+def parse_timeres_name(filename):
+    """ returns dict with scan_name and the scan parameters found in a timeres filename (missing params are None) """
+    name = Path(filename).name
+    params = {key: None for key in PARAM_TYPES}
+    params["scan_name"] = name[:-len(".timeres")] if name.endswith(".timeres") else name
+
+    first_match = None
+    for match in PARAM_PATTERN.finditer(name):
+        key, value = match.groups()
+        try:
+            params[key] = PARAM_TYPES[key](value)
+        except ValueError:
+            params[key] = None    # note: ex. 'sineFreq()' --> unknown
+        if first_match is None:
+            first_match = match
+    if first_match is not None:
+        params["scan_name"] = name[:first_match.start()].rstrip("_")   # everything before the first parameter
+    return params
+
+def get_scan_timestamp(filename):
+    """ returns the scan date and time as text (dd/mm/20yy (HHhMMmSSs)), as shown on the gifs """
+    params = parse_timeres_name(filename)
+    date, clock = params["date"], params["time"]
+    if date is None or len(date) != 6:
+        return "unknown"
+    return f"{date[4:6]}/{date[2:4]}/20{date[0:2]} ({clock})"
+
+
+# ----------- CATALOG FILE --------------
+def get_catalog_path(folder):
+    return Path(folder).joinpath(CATALOG_NAME)
+
+def load_catalog(folder):
+    """ returns {filename: entry} from the catalog file in a folder (empty if there is none yet) """
+    catalog_path = get_catalog_path(folder)
+    if not catalog_path.exists():
+        return {}
+    try:
+        with open(catalog_path, "r") as file:
+            catalog = json.load(file)
+    except (OSError, ValueError):
+        print(f"Could not read {catalog_path}, making a new catalog")
+        return {}
+    if catalog.get("version") != CATALOG_VERSION:
+        return {}
+    return catalog["files"]
+
+def save_catalog(folder, files):
+    """ saves the catalog, written to a temp file first so a crash never leaves half a catalog """
+    catalog_path = get_catalog_path(folder)
+    tmp_path = catalog_path.with_name(catalog_path.name + ".tmp")
+    with open(tmp_path, "w") as file:
+        json.dump({"version": CATALOG_VERSION, "files": files}, file, indent=1)
+    os.replace(tmp_path, catalog_path)
+
+def update_catalog(folder):
+    """ adds new/changed timeres files in the folder to its catalog and drops removed ones. Returns {filename: entry} """
+    files = load_catalog(folder)
+    changed = False
+
+    found = set()
+    with os.scandir(folder) as folder_entries:
+        for dir_entry in folder_entries:
+            if not dir_entry.name.endswith(".timeres") or not dir_entry.is_file():
+                continue
+            found.add(dir_entry.name)
+            stat = dir_entry.stat()
+            old = files.get(dir_entry.name)
+            if old is not None and old["size"] == stat.st_size and old["mtime_ns"] == stat.st_mtime_ns:
+                continue   # unchanged, no need to parse again
+            entry = parse_timeres_name(dir_entry.name)
+            entry.update({"filename": dir_entry.name, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns})
+            files[dir_entry.name] = entry
+            changed = True
+
+    for filename in set(files) - found:
+        del files[filename]
+        changed = True
+
+    if changed:
+        try:
+            save_catalog(folder, files)
+        except OSError as e:   # ex: read-only data drive, we still return the catalog for this lookup
+            print(f"Could not save catalog in {folder}: {e}")
+    return files
+
+
+# ----------- QUERIES --------------
+def matches(entry, clue="", **params):
+    """ checks if a catalog entry has the given params (ex: sineFreq=5) and 'clue' somewhere in its filename """
+    if clue and clue not in entry["filename"]:
+        return False
+    for key, value in params.items():
+        if value is None:
+            continue
+        if key not in entry:
+            raise KeyError(f"Unknown scan parameter '{key}', use one of {list(PARAM_TYPES) + ['scan_name']}")
+        if entry[key] is None:
+            return False
+        if isinstance(entry[key], float) or isinstance(value, float):
+            if abs(float(entry[key]) - float(value)) > 1e-9:   # note: so sineFreq=5 also finds 'sineFreq(5.0)'
+                return False
+        elif str(entry[key]) != str(value):
+            return False
+    return True
+
+def find_files(folders, clue="", **params):
+    """ returns catalog entries (with 'path') in one or more folders that match the params, newest scan first """
+    if isinstance(folders, (str, Path)):
+        folders = [folders]
+
+    found = []
+    for folder in folders:
+        for entry in update_catalog(folder).values():
+            if matches(entry, clue=clue, **params):
+                found.append(dict(entry, path=str(Path(folder).joinpath(entry["filename"]))))
+
+    found.sort(key=lambda entry: (entry["date"] or "", entry["time"] or "", entry["filename"]), reverse=True)
+    return found
@@ -0,0 +1,665 @@
+# Packages for reading timetag files
+import os
+import json
+import time
+from pathlib import Path
+import numpy as np
+
+
+# NOTE: Uncompressed Swabian binary, 16 bytes (128 bits) per record/entry, little endian:
+"""
+    bytes  0-3   -->  header word  (event type, reserved, missed events)
+    bytes  4-7   -->  channel      (signed int32, negative channel = falling edge)
+    bytes  8-15  -->  timestamp    (signed int64, unit picoseconds)
+
+    EXAMPLE BYTE STRINGS (entries):
+    b'\x00\x00\x00\x00     \x02 \x00\x00\x00     6\xf3\x1cNw        \x00\x00\x00'    --> channel  2
+    b'\x00\x00\x00\x00     \xff \xff\xff\xff    y\x1a\xb6`:         \x00\x00\x00'    --> channel -1
+"""
+
+"""
+USAGE:
+import swab_timeres_lib as TR
+
+records = TR.open_timeres(timetag_file)         # memory mapped, nothing is read into RAM yet
+records['channel'][:10]                         # <-- only these 10 records are read from disk
+
+for start, chunk in TR.iter_chunks(timetag_file, chunk_size=2**20):
+    photons = chunk['timestamp'][chunk['channel'] == 2]     # vectorized, one chunk at a time
+"""
+
+TIMERES_DTYPE = np.dtype([('header', '<u4'), ('channel', '<i4'), ('timestamp', '<i8')])
+RECORD_SIZE = TIMERES_DTYPE.itemsize    # = 16 bytes
+DEFAULT_CHUNK = 2**20                   # records per chunk --> 16 MB per chunk
+
+# Markers sent by the scan code. For every row (step) we get marker 102 (before step) and marker 101 (after step),
+#   and the sweep starts right after the second one. NOTE: both markers can also come in on the same channel.
+#   (101, 102) is for files where the marker channels were remapped. Files recorded by the GUI have both markers on channel 4
+#   (T7.cmd_marker, "..._marker4_28.eta"), so pass marker_channels=GUI_MARKER_CHANNELS (const["marker_channels"] in the analysis) for those
+MARKER_CHANNELS = (101, 102)
+GUI_MARKER_CHANNELS = (4,)
+MARKERS_PER_ROW = 2         # markers for each row/step
+ROW_START_MARKER = 1        # which of the row's markers (0=first, 1=second) the sweep starts at
+MARKER_DTYPE = np.dtype([('index', '<i8'), ('channel', '<i4'), ('timestamp', '<i8')])   # index = record nr in file
+
+# Undo log for in-place channel changes: (record index, original channel) for every record we overwrite
+UNDO_DTYPE = np.dtype([('index', '<i8'), ('channel', '<i4')])
+
+
+# ----------- READING RECORDS --------------
+def get_nr_records(timetag_file):
+    """ returns the number of complete 16-byte records in the file (a partially written last record is ignored) """
+    return os.path.getsize(timetag_file) // RECORD_SIZE
+
+def open_timeres(timetag_file, mode='r'):
+    """ returns the whole timeres file as a memory mapped structured array with fields 'header', 'channel', 'timestamp' """
+    # note: mode='r' is read only, mode='r+' lets us write changes straight back into the file
+    n_records = get_nr_records(timetag_file)
+    if n_records == 0:
+        # np.memmap can't map an empty file
+        return np.zeros(0, dtype=TIMERES_DTYPE)
+    return np.memmap(Path(timetag_file), dtype=TIMERES_DTYPE, mode=mode, shape=(n_records,))
+
+def iter_chunks(timetag_file, chunk_size=DEFAULT_CHUNK, start=0, stop=None, mode='r'):
+    """ yields (index of first record, chunk of records) through the file. Each chunk is a view into the memmap (no copy) """
+    if chunk_size < 1:
+        raise ValueError(f"chunk_size must be at least 1 record, got {chunk_size}")
+
+    # note: we also accept an already opened record array (e.g. from open_timeres), so callers can reuse one memmap
+    if isinstance(timetag_file, np.ndarray):
+        records = timetag_file
+    else:
+        records = open_timeres(timetag_file, mode=mode)
+
+    if stop is None or stop > len(records):
+        stop = len(records)
+
+    for i in range(start, stop, chunk_size):
+        yield i, records[i:min(i + chunk_size, stop)]
+
+
+# ----------- CHANGING CHANNELS --------------
+def get_channel_map(bad_ch=None, mapping=None):
+    """ returns a dict {old channel: new channel}. Channels in 'bad_ch' are changed to abs(ch)+100 (ex: -1 --> 101) """
+    channel_map = {}
+    if bad_ch is not None:
+        for ch in bad_ch:
+            channel_map[int(ch)] = abs(int(ch)) + 100
+    if mapping is not None:
+        # note: explicit user mapping wins over the default "abs(ch)+100" rule
+        for old_ch, new_ch in mapping.items():
+            channel_map[int(old_ch)] = int(new_ch)
+    return channel_map
+
+def get_channel_lut(channel_map):
+    """ returns (lookup table, lowest channel in table). lut[ch - lowest] is the new channel for ch """
+    lowest = min(channel_map)
+    lut = np.arange(lowest, max(channel_map) + 1, dtype=np.int32)   # channels not in the map are left as they are
+    for old_ch, new_ch in channel_map.items():
+        lut[old_ch - lowest] = new_ch
+    return lut, lowest
+
+def apply_channel_lut(channels, lut, lowest):
+    """ changes an int32 channel array in place using the lookup table, returns a bool mask of the changed entries """
+    idx = channels.astype(np.int64) - lowest
+    in_table = (idx >= 0) & (idx < len(lut))
+    new_channels = lut[idx[in_table]]
+    changed = np.zeros(len(channels), dtype=bool)
+    changed[in_table] = new_channels != channels[in_table]
+    channels[in_table] = new_channels
+    return changed
+
+def print_throughput(n_records, n_changed, elapsed):
+    """ prints records/s and MB/s so we can compare against disk bandwidth """
+    elapsed = max(elapsed, 1e-9)
+    print(f"--> {n_records} records ({n_changed} changed) in {round(elapsed, 3)} s  =  "
+          f"{n_records / elapsed:.3g} records/s  ({n_records * RECORD_SIZE / elapsed / 1e6:.1f} MB/s)")
+
+def remap_channels(old_file, new_file, bad_ch=None, mapping=None, chunk_size=DEFAULT_CHUNK):
+    """ writes a copy of 'old_file' with changed channel numbers, one chunk at a time (memory use is independent of file size) """
+    if Path(old_file).resolve() == Path(new_file).resolve():
+        raise ValueError(f"old and new file are the same: {old_file}")
+
+    channel_map = get_channel_map(bad_ch, mapping)
+    records = open_timeres(old_file)
+    n_changed = 0
+    if channel_map:
+        lut, lowest = get_channel_lut(channel_map)
+
+    t_start = time.time()
+    with open(new_file, "wb") as output_file:
+        for _, chunk in iter_chunks(records, chunk_size=chunk_size):
+            new_chunk = np.array(chunk)   # copy of this chunk only, so we don't write to the input file
+            if channel_map:
+                n_changed += int(np.count_nonzero(apply_channel_lut(new_chunk['channel'], lut, lowest)))
+            new_chunk.tofile(output_file)
+    print_throughput(len(records), n_changed, time.time() - t_start)
+
+    return len(records), n_changed
+
+
+# ----------- CHANGING CHANNELS IN PLACE --------------
+"""
+IN-PLACE JOURNAL:
+    <file>.remap_journal  -->  json with the channel map, chunk size and how far we have come (committed chunks)
+    <file>.remap_undo     -->  binary undo log, one UNDO_DTYPE entry per overwritten channel value
+
+    For each chunk: 1) append original channels to undo log   2) overwrite channels in file   3) commit chunk in journal
+    If a run is interrupted we can either call remap_channels_inplace() again to resume from the last committed chunk,
+    or call rollback_channel_remap() to put back every original channel value.
+"""
+
+def get_journal_paths(timetag_file):
+    """ returns (journal path, undo log path) for in-place changes of the timeres file """
+    return Path(str(timetag_file) + ".remap_journal"), Path(str(timetag_file) + ".remap_undo")
+
+def write_journal(journal_path, journal):
+    """ replaces the journal file atomically, so a crash never leaves a half written journal """
+    temp_path = journal_path.with_name(journal_path.name + ".tmp")
+    with open(temp_path, "w") as file:
+        json.dump(journal, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, journal_path)
+
+def read_undo_log(undo_path, n_entries=None):
+    """ returns undo entries from the undo log (a partially written last entry is ignored) """
+    if not undo_path.exists():
+        return np.zeros(0, dtype=UNDO_DTYPE)
+    with open(undo_path, "rb") as file:
+        raw = file.read()
+    n_complete = len(raw) // UNDO_DTYPE.itemsize
+    if n_entries is not None:
+        n_complete = min(n_complete, n_entries)
+    return np.frombuffer(raw[:n_complete * UNDO_DTYPE.itemsize], dtype=UNDO_DTYPE)
+
+def restore_channels(records, undo_entries):
+    """ writes original channel values back into the (writable) records """
+    # note: if a record was changed twice we keep its first (oldest = original) entry
+    indices, first = np.unique(undo_entries['index'], return_index=True)
+    records['channel'][indices] = undo_entries['channel'][first]
+
+def remap_channels_inplace(timetag_file, bad_ch=None, mapping=None, chunk_size=DEFAULT_CHUNK, keep_journal=False):
+    """ changes channel numbers directly in the file (no copy). Only the 4-byte channel field of changed records is written """
+    journal_path, undo_path = get_journal_paths(timetag_file)
+    channel_map = get_channel_map(bad_ch, mapping)
+    if not channel_map:
+        print("No channels to change")
+        return 0, 0
+
+    records = open_timeres(timetag_file, mode='r+')
+    journal = {
+        "channel_map": {str(k): v for k, v in channel_map.items()},    # note: json keys have to be strings
+        "chunk_size": int(chunk_size),
+        "n_records": len(records),
+        "next_chunk": 0,    # first chunk that is not committed yet
+        "undo_len": 0,      # number of committed entries in undo log
+    }
+
+    if journal_path.exists():
+        # --- RESUME INTERRUPTED RUN ---
+        with open(journal_path, "r") as file:
+            old_journal = json.load(file)
+        for key in ["channel_map", "chunk_size", "n_records"]:
+            if old_journal[key] != journal[key]:
+                raise ValueError(f"Found journal {journal_path} from a different remap ('{key}' differs). "
+                                 f"Use the same settings to resume, or rollback_channel_remap() first.")
+        journal = old_journal
+        # undo any changes from the chunk we were in the middle of, then continue from there
+        pending = read_undo_log(undo_path)[journal["undo_len"]:]
+        restore_channels(records, pending)
+        records.flush()
+        print(f"Resuming in-place remap from chunk {journal['next_chunk']} ({len(pending)} uncommitted changes undone)")
+    else:
+        write_journal(journal_path, journal)
+
+    # cut any uncommitted entries off the undo log before appending new ones
+    with open(undo_path, "ab") as undo_file:
+        undo_file.truncate(journal["undo_len"] * UNDO_DTYPE.itemsize)
+
+    lut, lowest = get_channel_lut(channel_map)
+    n_changed = journal["undo_len"]
+
+    t_start = time.time()
+    with open(undo_path, "ab") as undo_file:
+        for start, chunk in iter_chunks(records, chunk_size=chunk_size, start=journal["next_chunk"] * chunk_size):
+            new_channels = np.array(chunk['channel'])
+            changed = np.nonzero(apply_channel_lut(new_channels, lut, lowest))[0]
+
+            if len(changed) > 0:
+                # 1) save original values
+                undo_entries = np.zeros(len(changed), dtype=UNDO_DTYPE)
+                undo_entries['index'] = changed + start
+                undo_entries['channel'] = chunk['channel'][changed]
+                undo_file.write(undo_entries.tobytes())
+                undo_file.flush()
+                os.fsync(undo_file.fileno())
+
+                # 2) overwrite only the changed channel fields
+                chunk['channel'][changed] = new_channels[changed]
+                records.flush()
+
+            # 3) commit chunk
+            n_changed += len(changed)
+            journal["undo_len"] = n_changed
+            journal["next_chunk"] = start // chunk_size + 1
+            write_journal(journal_path, journal)
+
+    print_throughput(len(records), n_changed, time.time() - t_start)
+    del records   # closes memmap
+
+    if not keep_journal:
+        os.remove(journal_path)
+        os.remove(undo_path)
+    return journal["n_records"], n_changed
+
+def rollback_channel_remap(timetag_file):
+    """ puts back the original channel values from the undo log of an (interrupted or kept) in-place remap """
+    journal_path, undo_path = get_journal_paths(timetag_file)
+    if not undo_path.exists():
+        print(f"No undo log found for {timetag_file}, nothing to roll back")
+        return 0
+
+    undo_entries = read_undo_log(undo_path)
+    records = open_timeres(timetag_file, mode='r+')
+    restore_channels(records, undo_entries)
+    records.flush()
+    del records
+
+    os.remove(undo_path)
+    if journal_path.exists():
+        os.remove(journal_path)
+    print(f"--> Rolled back {len(undo_entries)} channel values in {timetag_file}")
+    return len(undo_entries)
+
+
+# ----------- MARKER INDEX (RANDOM ACCESS TO ROWS AND FRAMES) --------------
+"""
+Sidecar file "<name>.tridx" (next to "<name>.timeres") with the record index, channel and timestamp of every marker.
+It is made with one pass over the file and reused as long as the timeres file is unchanged.
+
+markers = TR.load_marker_index(timetag_file)
+start, stop = TR.get_frame_range(markers, frame=39, dimX=100)    # records for frame 40, no need to replay frames 1-39
+"""
+
+def get_index_path(timetag_file):
+    """ returns the path of the marker index sidecar for a timeres file """
+    return Path(timetag_file).with_suffix(".tridx")
+
+def find_markers(timetag_file, marker_channels=MARKER_CHANNELS, chunk_size=DEFAULT_CHUNK):
+    """ one pass through the file, returns a MARKER_DTYPE array with every marker event """
+    marker_channels = np.asarray(marker_channels, dtype=np.int32)
+    found = []
+    for start, chunk in iter_chunks(timetag_file, chunk_size=chunk_size):
+        hits = np.nonzero(np.isin(chunk['channel'], marker_channels))[0]
+        chunk_markers = np.zeros(len(hits), dtype=MARKER_DTYPE)
+        chunk_markers['index'] = hits + start
+        chunk_markers['channel'] = chunk['channel'][hits]
+        chunk_markers['timestamp'] = chunk['timestamp'][hits]
+        found.append(chunk_markers)
+    if len(found) == 0:
+        return np.zeros(0, dtype=MARKER_DTYPE)
+    return np.concatenate(found)
+
+def get_file_stamp(timetag_file):
+    """ returns info we use to check if an index still belongs to the file """
+    stat = os.stat(timetag_file)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def build_marker_index(timetag_file, marker_channels=MARKER_CHANNELS, chunk_size=DEFAULT_CHUNK):
+    """ finds all markers and saves them in the sidecar index file. Returns the markers """
+    markers = find_markers(timetag_file, marker_channels=marker_channels, chunk_size=chunk_size)
+    info = get_file_stamp(timetag_file)
+    info["marker_channels"] = [int(ch) for ch in marker_channels]
+
+    try:
+        with open(get_index_path(timetag_file), "wb") as file:   # note: file handle, otherwise numpy adds ".npz"
+            np.savez(file, markers=markers, info=np.array(json.dumps(info)))
+    except OSError as e:   # ex: read-only data drive, we still return the markers (index is rebuilt next time)
+        print(f"Could not save marker index {get_index_path(timetag_file).name}: {e}")
+    return markers
+
+def load_marker_index(timetag_file, marker_channels=MARKER_CHANNELS, chunk_size=DEFAULT_CHUNK):
+    """ returns the markers from the sidecar index, (re)building the index if it is missing or out of date """
+    index_path = get_index_path(timetag_file)
+    if index_path.exists():
+        with np.load(index_path) as index:
+            info = json.loads(str(index["info"]))
+            expected = get_file_stamp(timetag_file)
+            expected["marker_channels"] = [int(ch) for ch in marker_channels]
+            if info == expected:
+                return index["markers"]
+        print(f"Marker index {index_path.name} is out of date, rebuilding")
+    return build_marker_index(timetag_file, marker_channels=marker_channels, chunk_size=chunk_size)
+
+def get_nr_rows(markers, markers_per_row=MARKERS_PER_ROW):
+    """ number of complete rows in the marker index """
+    return len(markers) // markers_per_row
+
+def get_row_frame_map(markers, dimX, markers_per_row=MARKERS_PER_ROW):
+    """ returns (frame nr, row nr within frame) for every row in the file. Note: frame and row numbers start at 0 """
+    rows = np.arange(get_nr_rows(markers, markers_per_row))
+    return rows // dimX, rows % dimX
+
+def get_row_range(markers, row, markers_per_row=MARKERS_PER_ROW):
+    """ returns (first record, first record of next row) for a row. The first record is the row's first marker """
+    if not 0 <= row < get_nr_rows(markers, markers_per_row):
+        raise IndexError(f"row {row} is outside file with {get_nr_rows(markers, markers_per_row)} rows")
+    start = int(markers['index'][row * markers_per_row])
+    next_marker = (row + 1) * markers_per_row
+    stop = int(markers['index'][next_marker]) if next_marker < len(markers) else None   # None --> until end of file
+    return start, stop
+
+def get_row_start_time(markers, row, markers_per_row=MARKERS_PER_ROW, row_start_marker=ROW_START_MARKER):
+    """ returns the timestamp (ps) of the marker that starts the sweep of a row """
+    return int(markers['timestamp'][row * markers_per_row + row_start_marker])
+
+def get_frame_range(markers, frame, dimX, markers_per_row=MARKERS_PER_ROW):
+    """ returns (first record, first record of next frame) for a frame. Note: frame numbers start at 0 """
+    start, _ = get_row_range(markers, frame * dimX, markers_per_row)
+    if (frame + 1) * dimX < get_nr_rows(markers, markers_per_row):
+        stop, _ = get_row_range(markers, (frame + 1) * dimX, markers_per_row)
+    else:
+        stop = None
+    return start, stop
+
+
+# ----------- EXTRACTING FRAMES AND ROWS --------------
+"""
+Writes a smaller, normal timeres file with only some rows/frames, by copying the bytes between two markers.
+The new file starts at the first marker of the first row, so the analysis (and ETA recipes) read it like any other scan.
+
+TR.extract_frames(timetag_file, 'Data/frames_40-41.timeres', first_frame=39, last_frame=40, dimX=100)   # --> nr_frames = 2
+NOTE: every other frame is scanned backwards and flipped by the analysis. If first_frame is odd, the new file starts with a
+      backwards frame, so analyze it with const["first_frame_nr"] = first_frame (otherwise all its frames come out upside down)
+"""
+
+def copy_record_range(timetag_file, new_file, start, stop=None, chunk_size=DEFAULT_CHUNK):
+    """ copies records start..stop (stop=None --> end of file) into a new file without decoding them. Returns nr of records """
+    if Path(timetag_file).resolve() == Path(new_file).resolve():
+        raise ValueError("Can't extract records into the same file we read from")
+    if stop is None:
+        stop = get_nr_records(timetag_file)
+
+    n_bytes = (stop - start) * RECORD_SIZE
+    with open(timetag_file, "rb") as old, open(new_file, "wb") as new:
+        old.seek(start * RECORD_SIZE)
+        while n_bytes > 0:
+            block = old.read(min(n_bytes, chunk_size * RECORD_SIZE))
+            if not block:
+                break
+            new.write(block)
+            n_bytes -= len(block)
+    return stop - start
+
+def extract_rows(timetag_file, new_file, first_row, last_row, marker_channels=MARKER_CHANNELS, chunk_size=DEFAULT_CHUNK):
+    """ writes rows first_row..last_row (including last_row) into a new timeres file. Note: row numbers start at 0 """
+    markers = load_marker_index(timetag_file, marker_channels=marker_channels, chunk_size=chunk_size)
+    start, _ = get_row_range(markers, first_row)
+    _, stop = get_row_range(markers, last_row)
+
+    t_start = time.time()
+    n_records = copy_record_range(timetag_file, new_file, start, stop, chunk_size=chunk_size)
+    print(f"--> Extracted rows {first_row}-{last_row}: records {start}-{start + n_records} --> {new_file}")
+    print_throughput(n_records, 0, time.time() - t_start)
+    return n_records
+
+def extract_frames(timetag_file, new_file, first_frame, last_frame, dimX, marker_channels=MARKER_CHANNELS, chunk_size=DEFAULT_CHUNK):
+    """ writes frames first_frame..last_frame (including last_frame) into a new timeres file. Note: frame numbers start at 0 """
+    n_records = extract_rows(timetag_file, new_file, first_frame * dimX, (last_frame + 1) * dimX - 1,
+                             marker_channels=marker_channels, chunk_size=chunk_size)
+    if first_frame % 2 == 1:
+        print(f"CAUTION: first frame {first_frame} is a backwards frame, analyze {new_file} with const[\"first_frame_nr\"] = {first_frame} "
+              f"(otherwise the frames are flipped the wrong way)")
+    return n_records
+
+
+# ----------- COUNTING SIGNALS --------------
+SIGNAL_CHANNELS = (0, 1, 2, 3, 4, 5, 6, 7, 8, 100, 101, 102, 103)   # same channels as "signal_counter.eta"
+
+def get_time_window(records, t_start=None, t_stop=None):
+    """ returns (first record, stop record) for events between t_start and t_stop (ps, counted from the first event) """
+    # NOTE: assumes increasing timestamps (as written by the timetagger), so we can binary search the memmap (only ~log2(n) reads)
+    start, stop = 0, len(records)
+    if len(records) == 0:
+        return start, stop
+    t_first = int(records['timestamp'][0])
+    if t_start is not None:
+        start = int(np.searchsorted(records['timestamp'], t_first + t_start, side='left'))
+    if t_stop is not None:
+        stop = int(np.searchsorted(records['timestamp'], t_first + t_stop, side='left'))
+    return start, max(start, stop)
+
+def count_channels(channels, counts):
+    """ adds the number of events per channel in 'channels' to the 'counts' dict """
+    if len(channels) == 0:
+        return counts
+    lowest, highest = int(channels.min()), int(channels.max())
+    if highest - lowest < 2**16:
+        # small channel range (normal case) --> bincount is a lot faster than sorting with np.unique
+        per_channel = np.bincount(channels - lowest)
+        found = np.nonzero(per_channel)[0]
+        values, n_events = found + lowest, per_channel[found]
+    else:
+        values, n_events = np.unique(channels, return_counts=True)
+    for ch, n in zip(values, n_events):
+        counts[int(ch)] = counts.get(int(ch), 0) + int(n)
+    return counts
+
+def count_signals(timetag_file, channels=SIGNAL_CHANNELS, t_start=None, t_stop=None, chunk_size=DEFAULT_CHUNK):
+    """ returns {channel: number of events}. All listed channels are included (also with 0 counts), plus any other channel found """
+    records = open_timeres(timetag_file)
+    start, stop = get_time_window(records, t_start, t_stop)
+
+    counts = {int(ch): 0 for ch in channels}
+    for _, chunk in iter_chunks(records, chunk_size=chunk_size, start=start, stop=stop):
+        count_channels(chunk['channel'], counts)
+    return counts
+
+def summarize_file(timetag_file, channels=SIGNAL_CHANNELS, marker_channels=MARKER_CHANNELS, chunk_size=DEFAULT_CHUNK):
+    """ returns dict with counts per channel, nr of markers, duration (s) and mean count rate (Hz, markers not included) """
+    records = open_timeres(timetag_file)
+    counts = count_signals(timetag_file, channels=channels, chunk_size=chunk_size)
+
+    duration = 0.0
+    if len(records) > 1:
+        duration = (int(records['timestamp'][-1]) - int(records['timestamp'][0])) * 1e-12   # ps --> s
+    n_markers = sum(counts.get(ch, 0) for ch in marker_channels)
+    n_signals = len(records) - n_markers
+
+    return {
+        "file": str(timetag_file),
+        "size_MB": round(os.path.getsize(timetag_file) / 1e6, 3),
+        "n_records": len(records),
+        "n_markers": n_markers,
+        "duration_s": duration,
+        "mean_rate_Hz": n_signals / duration if duration > 0 else 0.0,
+        "counts": counts,
+    }
+
+
+# ----------- CHECKING FILES --------------
+GAP_ROWS = 10   # default gap: this many row periods without any event
+
+def validate_timeres(timetag_file, step_dim=None, nr_frames=None, sine_freq=None, marker_channels=MARKER_CHANNELS,
+                     gap_ps=None, jitter_tol=0.05, row_period_ps=None, chunk_size=DEFAULT_CHUNK):
+    """ one pass over the file to check markers, time order and gaps before analysis. Returns a report dict (see 'problems') """
+    # note: step_dim = rows per frame (const["dimX"]), sine_freq in Hz.
+    # NOTE: a row takes one sine period plus the step delay (T7.extra_delay) and LabJack overhead, so rows are compared to
+    #   row_period_ps if given, otherwise to the median time between row starts. Only rows more than jitter_tol off are problems.
+    #   Default gap (gap_ps=None) = GAP_ROWS row periods, so dark rows are not counted as gaps
+    period_ps = 1e12 / sine_freq if sine_freq else None
+    # note: the row period is only known after the pass, so we keep every step longer than this and count the gaps at the end
+    candidate_ps = gap_ps if gap_ps is not None else min(p for p in (period_ps, row_period_ps, 1e8) if p)
+    gap_candidates = []
+
+    t_0 = time.time()
+    counts = {}
+    marker_times = []
+    n_backwards, first_backwards = 0, None
+    max_gap, max_gap_at = 0, None
+    t_prev = None
+    n_records = 0
+    for start, chunk in iter_chunks(timetag_file, chunk_size=chunk_size):
+        n_records += len(chunk)
+        count_channels(chunk['channel'], counts)
+        marker_times.append(chunk['timestamp'][np.isin(chunk['channel'], marker_channels)])
+
+        # diffs within the chunk, plus the step from the last event of the previous chunk
+        ts = chunk['timestamp']
+        deltas = np.diff(ts, prepend=ts[0] if t_prev is None else t_prev)
+
+        backwards = np.flatnonzero(deltas < 0)
+        if len(backwards) > 0 and first_backwards is None:
+            first_backwards = start + int(backwards[0])
+        n_backwards += len(backwards)
+
+        gap_candidates.append(deltas[deltas > candidate_ps])
+        i_max = int(np.argmax(deltas))
+        if deltas[i_max] > max_gap:
+            max_gap, max_gap_at = int(deltas[i_max]), start + i_max
+        t_prev = ts[-1]
+
+    marker_times = np.concatenate(marker_times) if marker_times else np.zeros(0, dtype=np.int64)
+    gap_candidates = np.concatenate(gap_candidates) if gap_candidates else np.zeros(0, dtype=np.int64)
+    n_rows = len(marker_times) // MARKERS_PER_ROW
+    report = {
+        "file": str(timetag_file),
+        "n_records": n_records,
+        "channels": counts,
+        "n_markers": len(marker_times),
+        "n_rows": n_rows,
+        "expected_rows": step_dim * nr_frames if step_dim and nr_frames else None,
+        "n_backwards": n_backwards,
+        "first_backwards": first_backwards,
+        "n_gaps": None,
+        "gap_ps": None,
+        "max_gap_ps": max_gap,
+        "max_gap_at": max_gap_at,
+        "row_period_ps": None,
+        "row_period_jitter_ps": None,
+        "problems": [],
+    }
+    problems = report["problems"]
+
+    # marker cadence: time between row starts should be the same for all rows (and at least one sine period)
+    row_starts = marker_times[ROW_START_MARKER::MARKERS_PER_ROW]
+    if len(row_starts) > 1:
+        periods = np.diff(row_starts)
+        expected_ps = row_period_ps if row_period_ps else float(np.median(periods))
+        report["row_period_ps"] = float(np.median(periods))
+        report["row_period_jitter_ps"] = float(np.median(np.abs(periods - expected_ps)))   # note: robust, outliers don't change it
+        n_off = int(np.count_nonzero(np.abs(periods - expected_ps) > jitter_tol * expected_ps))
+        if n_off > 0:
+            problems.append(f"{n_off} rows are more than {jitter_tol * 100}% off the row period ({expected_ps:.0f} ps)")
+        if period_ps and report["row_period_ps"] < (1 - jitter_tol) * period_ps:
+            problems.append(f"rows ({report['row_period_ps']:.0f} ps) are shorter than one sine period ({period_ps:.0f} ps)")
+
+    if gap_ps is None:
+        row_ps = row_period_ps or report["row_period_ps"] or period_ps
+        gap_ps = GAP_ROWS * row_ps if row_ps else 1e9
+    n_gaps = int(np.count_nonzero(gap_candidates > gap_ps))
+    report["n_gaps"], report["gap_ps"] = n_gaps, gap_ps
+
+    if n_records == 0:
+        problems.append("file is empty")
+    if len(marker_times) == 0:
+        problems.append(f"no markers found on channels {marker_channels}")
+    elif len(marker_times) % MARKERS_PER_ROW != 0:
+        problems.append(f"odd nr of markers ({len(marker_times)}), expected {MARKERS_PER_ROW} per row")
+    if report["expected_rows"] is not None and n_rows < report["expected_rows"]:
+        problems.append(f"only {n_rows} of {report['expected_rows']} rows (step_dim * nr_frames)")
+    if n_backwards > 0:
+        problems.append(f"{n_backwards} timestamps go backwards (first at record {first_backwards})")
+    if n_gaps > 0:
+        problems.append(f"{n_gaps} gaps longer than {gap_ps:.0f} ps without events (longest {max_gap} ps at record {max_gap_at})")
+
+    report["ok"] = len(problems) == 0
+    report["elapsed_s"] = round(time.time() - t_0, 3)
+    return report
+
+def print_report(report):
+    """ prints a validation report from validate_timeres() """
+    print(f"File: {report['file']}  ({report['n_records']} records, checked in {report['elapsed_s']} s)")
+    print(f"    channels: {report['channels']}")
+    print(f"    markers: {report['n_markers']} --> rows: {report['n_rows']}  (expected: {report['expected_rows']})")
+    if report["row_period_ps"] is not None:
+        print(f"    row period: {report['row_period_ps']:.0f} ps  (jitter, median deviation: {report['row_period_jitter_ps']:.0f} ps)")
+    print(f"    longest gap: {report['max_gap_ps']} ps  (gaps counted above {report['gap_ps']:.0f} ps)")
+    if report["ok"]:
+        print("    --> OK")
+    for problem in report["problems"]:
+        print(f"    PROBLEM: {problem}")
+
+
+# ----------- FOLLOWING A FILE WHILE IT IS WRITTEN --------------
+"""
+The timetagger keeps appending to the timeres file during the scan. Instead of waiting until the file is closed,
+we poll the file size and only read whole 16-byte records (a half written record is picked up on the next poll).
+
+for row_nr, row_records in TR.follow_rows(timetag_file, expected_rows=dimX*nr_frames):
+    ...     # row is complete as soon as the next row's first marker has arrived
+"""
+
+def follow_timeres(timetag_file, expected_rows=None, marker_channels=MARKER_CHANNELS, poll_interval=0.1, timeout=10.0,
+                   settle_time=1.0, chunk_size=DEFAULT_CHUNK):
+    """ yields (index of first record, records) as new records are written to the file, until the scan is done.
+    Note: give marker_channels=(4,) for files from the GUI, see MARKER_CHANNELS """
+    # scan is done when: all expected rows have their markers and nothing new for 'settle_time' seconds (> one row, 1/sine_freq),
+    #                    or nothing new has been written for 'timeout' seconds
+    expected_markers = expected_rows * MARKERS_PER_ROW if expected_rows else None
+    n_markers = 0
+    pos = 0
+    t_last_data = time.time()
+
+    while not os.path.exists(timetag_file):
+        if time.time() - t_last_data > timeout:
+            print(f"Timeout: {timetag_file} was never created")
+            return
+        time.sleep(poll_interval)
+
+    with open(timetag_file, "rb") as file:
+        while True:
+            n_new = (os.path.getsize(timetag_file) - pos * RECORD_SIZE) // RECORD_SIZE   # only complete records
+            if n_new > 0:
+                file.seek(pos * RECORD_SIZE)
+                for start in range(pos, pos + n_new, chunk_size):
+                    n = min(chunk_size, pos + n_new - start)
+                    records = np.frombuffer(file.read(n * RECORD_SIZE), dtype=TIMERES_DTYPE)
+                    n_markers += int(np.count_nonzero(np.isin(records['channel'], marker_channels)))
+                    yield start, records
+                pos += n_new
+                t_last_data = time.time()
+            elif expected_markers is not None and n_markers >= expected_markers and time.time() - t_last_data > settle_time:
+                print(f"--> Scan done: all {expected_rows} rows found ({pos} records)")
+                return
+            elif time.time() - t_last_data > timeout:
+                print(f"--> No new data for {timeout} s, stopping ({pos} records, {n_markers // MARKERS_PER_ROW} rows)")
+                return
+            else:
+                time.sleep(poll_interval)
+
+def follow_rows(timetag_file, expected_rows=None, marker_channels=MARKER_CHANNELS, poll_interval=0.1, timeout=10.0, settle_time=1.0):
+    """ yields (row nr, records of the row) for each complete row while the file is written. Note: row numbers start at 0 """
+    marker_channels = np.asarray(marker_channels, dtype=np.int32)
+    pending = np.zeros(0, dtype=TIMERES_DTYPE)   # records of rows that are not complete yet
+    row_nr = 0
+    for _, records in follow_timeres(timetag_file, expected_rows, marker_channels, poll_interval, timeout, settle_time):
+        pending = np.concatenate([pending, records])
+        row_starts = np.flatnonzero(np.isin(pending['channel'], marker_channels))[::MARKERS_PER_ROW]
+        # everything before the last row start belongs to complete rows
+        for start, stop in zip(row_starts[:-1], row_starts[1:]):
+            yield row_nr, pending[start:stop]
+            row_nr += 1
+        if len(row_starts) > 0:
+            pending = pending[row_starts[-1]:]
+    # last row ends with the file
+    if len(pending) > 0 and np.any(np.isin(pending['channel'], marker_channels)):
+        yield row_nr, pending
+
+def wait_until_written(timetag_file, expected_rows=None, marker_channels=MARKER_CHANNELS, poll_interval=0.1, timeout=10.0, settle_time=1.0):
+    """ blocks until the scan is done writing the file (see follow_timeres), returns nr of records """
+    n_records = 0
+    for _, records in follow_timeres(timetag_file, expected_rows, marker_channels, poll_interval=poll_interval, timeout=timeout, settle_time=settle_time):
+        n_records += len(records)
+    return n_records
@@ -0,0 +1,178 @@
+# Packages for reading timetag files from different timetaggers
+import os
+from pathlib import Path
+import numpy as np
+
+import swab_timeres_lib as TR
+
+
+# NOTE FORMAT TYPES (same numbers as ETA, see "get_row_from_eta()"):
+"""
+Value   |   ETA Constant/Name        |      Format for Device                   |   Layout
+--------------------------------------------------------------------------------------------------------------------------
+1           eta.FORMAT_SI_16bytes           Swabian Instrument binary               no header, 16 bytes: header word (uint32), channel (int32), time (int64)
+2           eta.FORMAT_QT_COMPRESSED        compressed qutools quTAG binary         40 byte header, 5 bytes: bits 0-36 time, bits 37-39 channel
+4           eta.FORMAT_QT_BINARY            qutools quTAG 10-byte Binary            40 byte header, 10 bytes: time (uint64), channel (uint16)
+
+All formats are decoded into the same normalized records (TR.TIMERES_DTYPE: header, channel, timestamp in ps),
+so the same analysis code works for both the Swabian and the quTAG setup.
+
+USAGE:
+import timetag_formats as TF
+for start, events in TF.iter_events(timetag_file):         # format is detected automatically
+    photons = events['timestamp'][events['channel'] == 2]
+counts = TF.count_signals(timetag_file)                    # same as TR.count_signals(), for any format
+
+CHECK:  python timetag_formats.py     (writes small quTAG files laid out the way ETA reads them and decodes them again)
+"""
+
+FORMAT_SI_16bytes = 1
+FORMAT_QT_COMPRESSED = 2
+FORMAT_QT_BINARY = 4
+
+QT_HEADER_SIZE = 40                     # bytes before the first quTAG record (ETA: clip_file(...).headeroffset)
+QT_BINARY_MAGIC = b'\x87\xb3\x91\xfa'   # first bytes of a quTAG binary file (same check as ETA does)
+QT_BINARY_DTYPE = np.dtype([('timestamp', '<u8'), ('channel', '<u2')])     # packed --> 10 bytes
+QT_COMPRESSED_SIZE = 5
+QT_COMPRESSED_TIME_BITS = 37
+
+FORMAT_NAMES = {
+    FORMAT_SI_16bytes: "Swabian 16 bytes",
+    FORMAT_QT_COMPRESSED: "quTAG compressed",
+    FORMAT_QT_BINARY: "quTAG binary",
+}
+
+
+# ----------- DETECTING FORMAT --------------
+def looks_like_swabian(raw, n_check=1000):
+    """ checks if the first records look like Swabian 16-byte records (small channel numbers, increasing time) """
+    n = min(len(raw) // TR.RECORD_SIZE, n_check)
+    if n == 0:
+        return False
+    records = np.frombuffer(raw[:n * TR.RECORD_SIZE], dtype=TR.TIMERES_DTYPE)
+    small_channels = np.all(np.abs(records['channel']) < 2**12)
+    increasing = np.all(np.diff(records['timestamp']) >= 0) and records['timestamp'][0] >= 0
+    return bool(small_channels and increasing)
+
+def detect_format(timetag_file):
+    """ returns the format number of a timetag file, based on its first bytes """
+    with open(timetag_file, "rb") as file:
+        raw = file.read(QT_HEADER_SIZE + 1000 * TR.RECORD_SIZE)
+
+    if raw[:len(QT_BINARY_MAGIC)] == QT_BINARY_MAGIC:
+        return FORMAT_QT_BINARY
+    if looks_like_swabian(raw):
+        return FORMAT_SI_16bytes
+
+    # compressed quTAG files have no magic that we know of, so we check if the times make sense
+    n_compressed = max(len(raw) - QT_HEADER_SIZE, 0) // QT_COMPRESSED_SIZE
+    raw_compressed = np.frombuffer(raw, dtype=np.uint8, count=n_compressed * QT_COMPRESSED_SIZE, offset=min(QT_HEADER_SIZE, len(raw)))
+    events = decode_qt_compressed(raw_compressed.reshape(-1, QT_COMPRESSED_SIZE))
+    if len(events) > 0 and np.all(np.diff(events['timestamp']) >= 0):
+        return FORMAT_QT_COMPRESSED
+
+    raise ValueError(f"Could not detect timetag format of {timetag_file}. Give it with 'timetag_format=' instead")
+
+
+# ----------- DECODING --------------
+def decode_qt_binary(raw_records):
+    """ quTAG 10-byte records --> normalized records """
+    events = np.zeros(len(raw_records), dtype=TR.TIMERES_DTYPE)
+    events['channel'] = raw_records['channel']
+    events['timestamp'] = raw_records['timestamp']
+    return events
+
+def decode_qt_compressed(raw_records):
+    """ quTAG 5-byte records (uint8 array of shape (n, 5)) --> normalized records """
+    # put the 5 little endian bytes together into one 40-bit number per record
+    packed = np.zeros(len(raw_records), dtype=np.uint64)
+    for i in range(QT_COMPRESSED_SIZE):
+        packed |= raw_records[:, i].astype(np.uint64) << np.uint64(8 * i)
+
+    events = np.zeros(len(raw_records), dtype=TR.TIMERES_DTYPE)
+    events['timestamp'] = packed & np.uint64(2**QT_COMPRESSED_TIME_BITS - 1)
+    events['channel'] = (packed >> np.uint64(QT_COMPRESSED_TIME_BITS)) & np.uint64(7)
+    return events
+
+
+# ----------- READING --------------
+def open_timetags(timetag_file, timetag_format=None):
+    """ returns (memory mapped raw records, format). Raw records are not decoded yet, see iter_events() """
+    if timetag_format is None:
+        timetag_format = detect_format(timetag_file)
+
+    if timetag_format == FORMAT_SI_16bytes:
+        return TR.open_timeres(timetag_file), timetag_format
+
+    if timetag_format == FORMAT_QT_BINARY:
+        n_records = max(os.path.getsize(timetag_file) - QT_HEADER_SIZE, 0) // QT_BINARY_DTYPE.itemsize
+        dtype, shape = QT_BINARY_DTYPE, (n_records,)
+    elif timetag_format == FORMAT_QT_COMPRESSED:
+        n_records = max(os.path.getsize(timetag_file) - QT_HEADER_SIZE, 0) // QT_COMPRESSED_SIZE
+        dtype, shape = np.uint8, (n_records, QT_COMPRESSED_SIZE)
+    else:
+        raise ValueError(f"Timetag format {timetag_format} is not supported, use one of {FORMAT_NAMES}")
+
+    if n_records == 0:
+        return np.zeros(shape, dtype=dtype), timetag_format
+    return np.memmap(Path(timetag_file), dtype=dtype, mode='r', offset=QT_HEADER_SIZE, shape=shape), timetag_format
+
+def decode(raw_records, timetag_format):
+    """ returns normalized records (TR.TIMERES_DTYPE) for a slice of raw records """
+    if timetag_format == FORMAT_SI_16bytes:
+        return raw_records      # already normalized, no copy
+    if timetag_format == FORMAT_QT_BINARY:
+        return decode_qt_binary(raw_records)
+    return decode_qt_compressed(raw_records)
+
+def iter_events(timetag_file, timetag_format=None, chunk_size=TR.DEFAULT_CHUNK, start=0, stop=None):
+    """ yields (index of first record, normalized records) through any supported timetag file, one chunk at a time """
+    raw_records, timetag_format = open_timetags(timetag_file, timetag_format)
+    for i, raw_chunk in TR.iter_chunks(raw_records, chunk_size=chunk_size, start=start, stop=stop):
+        yield i, decode(raw_chunk, timetag_format)
+
+
+# ----------- COUNTING SIGNALS --------------
+def count_signals(timetag_file, channels=TR.SIGNAL_CHANNELS, timetag_format=None, chunk_size=TR.DEFAULT_CHUNK):
+    """ returns {channel: number of events} like TR.count_signals(), for any supported timetag format """
+    counts = {int(ch): 0 for ch in channels}
+    for _, events in iter_events(timetag_file, timetag_format, chunk_size=chunk_size):
+        TR.count_channels(events['channel'], counts)
+    return counts
+
+
+# ----------- ROUND TRIP CHECK --------------
+def write_qt_test_file(timetag_file, timestamps, channels, timetag_format):
+    """ writes a quTAG file the way ETA reads it: 40 byte header (ETA's headeroffset), then packed little endian records """
+    # NOTE: the header and record layout are written out by hand here (not with QT_HEADER_SIZE/QT_BINARY_DTYPE), so the check doesn't just test the module against itself
+    header = bytearray(40)
+    if timetag_format == FORMAT_QT_BINARY:
+        header[:4] = b'\x87\xb3\x91\xfa'
+        body = b''.join(int(ts).to_bytes(8, 'little') + int(ch).to_bytes(2, 'little') for ts, ch in zip(timestamps, channels))
+    else:   # note: no magic known for compressed files
+        body = b''.join((int(ts) | (int(ch) << 37)).to_bytes(5, 'little') for ts, ch in zip(timestamps, channels))
+    with open(timetag_file, "wb") as file:
+        file.write(bytes(header) + body)
+
+def check_round_trip(folder=None):
+    """ writes quTAG binary and compressed test files, reads them back and checks format, times and channels """
+    import tempfile
+    rng = np.random.default_rng(0)
+    timestamps = np.cumsum(rng.integers(1, 10**6, 5000))
+    channels = rng.integers(1, 8, 5000)
+
+    with tempfile.TemporaryDirectory(dir=folder) as tmp_dir:
+        for timetag_format in [FORMAT_QT_BINARY, FORMAT_QT_COMPRESSED]:
+            timetag_file = os.path.join(tmp_dir, f"test_{timetag_format}.timeres")
+            write_qt_test_file(timetag_file, timestamps, channels, timetag_format)
+
+            assert detect_format(timetag_file) == timetag_format, f"{FORMAT_NAMES[timetag_format]}: detected as {detect_format(timetag_file)}"
+            events = np.concatenate([chunk for _, chunk in iter_events(timetag_file, chunk_size=777)])
+            assert np.array_equal(events['timestamp'], timestamps), f"{FORMAT_NAMES[timetag_format]}: wrong timestamps"
+            assert np.array_equal(events['channel'], channels), f"{FORMAT_NAMES[timetag_format]}: wrong channels"
+            assert count_signals(timetag_file, channels=[])[3] == np.count_nonzero(channels == 3)
+            print(f"{FORMAT_NAMES[timetag_format]}: OK ({len(events)} events)")
+
+
+if __name__ == "__main__":
+    check_round_trip()